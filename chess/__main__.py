@@ -1,38 +1,89 @@
+import argparse
+
 import controllers
+import session
 import views
+from models import core, db, exceptions, writer
 from models.translate import TRANSLATION
 
 WELCOME_TEXT = TRANSLATION["welcome"]
 ASK_TEXT = TRANSLATION["main_ask"]
+ASK_TEXT_SAVING = TRANSLATION["main_ask_saving"]
 INVALID_COMMAND_ERROR = TRANSLATION["invalid_command"]
 INVALID_COMMAND_OR_ARGUMENT_ERROR = TRANSLATION["invalid_command_argument"]
+SAVE_CONFLICT_ERROR = TRANSLATION["controller"]["save_conflict"]
+BACKGROUND_SAVE_OPTION = "--sauvegarde_differee"
+RECORD_OPTION = "--enregistrer"
+COMPRESSION_OPTION = "--compression"
+PAIRING_TRACE_OPTION = "--trace_complete"
+
+
+def display_save_errors(view):
+    """Merge in the tournaments what the saves made in the background merged, display the conflicts they found, and
+    raise any other error."""
+    if writer.WRITER is None:
+        return
+    writer.WRITER.merge_written()
+    for error in writer.WRITER.take_errors():
+        if isinstance(error, exceptions.ConflictError):
+            view.display(SAVE_CONFLICT_ERROR)
+        else:
+            raise error
 
 
-def main():
-    current_view = views.View()
+def main(background_save=False, view=None):
+    current_view = views.View() if view is None else view
     current_view.display(WELCOME_TEXT)
     main_controller = current_controller = controllers.GlobalController(current_view)
     running = True
-    while running:
-        try:
-            command, kwargs = current_view.ask_command(ASK_TEXT)
-        except KeyError:
-            current_view.display(INVALID_COMMAND_OR_ARGUMENT_ERROR)
-        else:
-            try:
-                result = getattr(current_controller, command)(**kwargs)
-            except AttributeError:
-                current_view.display(INVALID_COMMAND_ERROR)
-                result = None
-            if type(result) == controllers.TournamentController:
-                current_controller = result
-            elif result == "exit":
-                current_controller = main_controller
-            elif result == "close":
-                running = False
-        current_view.display("")  # No need for \n since the print will already create a line.
-        pass
+    if background_save:
+        writer.start()
+    try:
+        while running:
+            # The output of each command is written at once when the command is over (or asks something).
+            with current_view.buffered():
+                saving = writer.WRITER is not None and writer.WRITER.pending
+                try:
+                    command, kwargs = current_view.ask_command(ASK_TEXT_SAVING if saving else ASK_TEXT)
+                except KeyError:
+                    current_view.display(INVALID_COMMAND_OR_ARGUMENT_ERROR)
+                else:
+                    try:
+                        result = getattr(current_controller, command)(**kwargs)
+                    except AttributeError:
+                        current_view.display(INVALID_COMMAND_ERROR)
+                        result = None
+                    if type(result) == controllers.TournamentController:
+                        current_controller = result
+                    elif result == "exit":
+                        writer.flush()
+                        current_controller = main_controller
+                    elif result == "close":
+                        writer.flush()
+                        running = False
+                display_save_errors(current_view)
+                current_view.display("")  # No need for \n since the print will already create a line.
+    finally:
+        # Whatever happens, nothing that was saved in the background is lost.
+        writer.stop()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(BACKGROUND_SAVE_OPTION, action="store_true", dest="background_save")
+    parser.add_argument(RECORD_OPTION, metavar="FICHIER", dest="record")
+    parser.add_argument(COMPRESSION_OPTION, choices=db.COMPRESSED_STORAGES, dest="compression")
+    parser.add_argument(PAIRING_TRACE_OPTION, action="store_true", dest="pairing_trace")
+    arguments = parser.parse_args()
+    core.SAVE_PAIRING_TRACE = arguments.pairing_trace
+    if arguments.compression:
+        # The database is compressed the next time it is written, and stays readable without the option.
+        db.use_database(db.DATABASE_PATH, storage=db.COMPRESSED_STORAGES[arguments.compression])
+    if arguments.record:
+        recording_view = session.RecordingView(arguments.record, arguments.background_save)
+        try:
+            main(arguments.background_save, recording_view)
+        finally:
+            recording_view.save()
+    else:
+        main(arguments.background_save)
@@ -0,0 +1,227 @@
+"""Measure the cost of the storage operations on synthetic databases of various sizes.
+
+Run it from the chess folder with `python benchmark.py --scale club`. The report is printed and saved as JSON, and a
+previous report can be given with --compare to display how much each operation changed."""
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import controllers
+import views
+from models import cache, core, db, history, snapshot
+
+# Amount of members and tournaments for each scale.
+SCALES = {"club": (1000, 100),
+          "league": (10000, 1000),
+          "federation": (100000, 10000)}
+RESULTS = ["1-0", "0-1", "1/2-1/2"]
+
+
+class CountingStorage(db.LockedJSONStorage):
+    """A storage that counts the bytes it writes."""
+    bytes_written = 0
+
+    def write(self, data):
+        super().write(data)
+        CountingStorage.bytes_written += os.path.getsize(self.path)
+
+
+class CountingGzipStorage(CountingStorage, db.GzipJSONStorage):
+    pass
+
+
+class CountingLzmaStorage(CountingStorage, db.LzmaJSONStorage):
+    pass
+
+
+# The storage used for each compression.
+STORAGES = {None: CountingStorage, "gzip": CountingGzipStorage, "lzma": CountingLzmaStorage}
+
+
+class SilentView(views.View):
+    """A view that displays nothing, so that only the work of the controller is measured."""
+
+    def display(self, text):
+        pass
+
+
+def generate_tournament(member_ids, number, player_amount, round_amount, generator):
+    """Return a serialized finished tournament played by random members with random results."""
+    participants = generator.sample(member_ids, player_amount)
+    players = [{"member_index": i, "opponents": [], "points": 0} for i in range(player_amount)]
+    rounds = []
+    for round_number in range(1, round_amount + 1):
+        order = list(range(player_amount))
+        generator.shuffle(order)
+        games = []
+        for white, black in zip(order[::2], order[1::2]):
+            score = generator.choice(RESULTS)
+            white_points, black_points = {"1-0": (1, 0), "0-1": (0, 1), "1/2-1/2": (0.5, 0.5)}[score]
+            players[white]["points"] += white_points
+            players[black]["points"] += black_points
+            players[white]["opponents"].append(black)
+            players[black]["opponents"].append(white)
+            games.append({"white_player_index": white, "black_player_index": black, "score": score})
+        rounds.append({"round_number": round_number, "starting_time": "14:00", "ending_time": "16:00",
+                       "finished": True, "games": games})
+    day = 1 + number % 28
+    month = 1 + (number // 28) % 12
+    return {"name": f"Tournoi{number}",
+            "place": "Paris",
+            "date": f"{day:02d}/{month:02d}/{2000 + number // 336}",
+            "max_round": round_amount,
+            "tournament_type": "Blitz",
+            "description": "",
+            "participant_amount": player_amount,
+            "participants": participants,
+            "rounds": rounds,
+            "players": players,
+            "is_started": True,
+            "version": 1,
+            "system": core.SWISS,
+            "schedule": None,
+            "schema": core.SCHEMA_VERSION}
+
+
+def generate_database(path, member_amount, tournament_amount, player_amount=16, round_amount=5, seed=0):
+    """Write at path a database in the format used by the program, with random members and tournaments."""
+    generator = random.Random(seed)
+    members = {}
+    for i in range(1, member_amount + 1):
+        members[i] = {"surname": f"NOM{i}",
+                      "name": "Prenom",
+                      "birthdate": f"{generator.randint(1, 28):02d}/{generator.randint(1, 12):02d}/"
+                                   f"{generator.randint(1940, 2015)}",
+                      "gender": generator.choice(["Homme", "Femme"]),
+                      "ranking": generator.randint(1000, 2800),
+                      "discriminator": 0}
+    member_ids = list(members)
+    tournaments = {str(i): generate_tournament(member_ids, i, min(player_amount, member_amount),
+                                               round_amount, generator)
+                   for i in range(1, tournament_amount + 1)}
+    with open(path, "w", encoding="utf-8") as database_file:
+        json.dump({"members": {str(i): member for i, member in members.items()},
+                   "tournaments": tournaments,
+                   "meta": {}}, database_file)
+
+
+def database_bytes(path):
+    """Return the size of the files of a database on disk: the database file and its shards, and their indexes."""
+    root, extension = os.path.splitext(path)
+    files = [path] + glob.glob(f"{glob.escape(root)}_*{extension}")
+    indexes = [index for file in files for index in glob.glob(f"{glob.escape(file)}.*.idx")]
+    return sum(map(os.path.getsize, files)), sum(map(os.path.getsize, indexes))
+
+
+def measure(operation, repeat, before=None):
+    """Return the latency, the bytes written and the peak of memory allocated by an operation. If before is given,
+    it is called before each run without being measured, to empty or fill the cache for example."""
+    durations = []
+    bytes_written = 0
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        CountingStorage.bytes_written = 0
+        start = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - start)
+        bytes_written += CountingStorage.bytes_written
+    bytes_written //= repeat
+    if before is not None:
+        before()
+    tracemalloc.start()
+    operation()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"median_seconds": statistics.median(durations),
+            "min_seconds": min(durations),
+            "bytes_written": bytes_written,
+            "peak_memory_bytes": peak_memory}
+
+
+def run(scale, repeat, directory, compression=None):
+    """Generate a database of the given scale in directory and return the report of all operations, the database
+    being written with a compression if one is given."""
+    member_amount, tournament_amount = SCALES[scale]
+    path = os.path.join(directory, f"benchmark_{scale}.json")
+    generate_database(path, member_amount, tournament_amount)
+    storage = STORAGES[compression](path)
+    storage.write(storage.read())
+    storage.close()
+    db.use_database(path, storage=STORAGES[compression])
+    # The history of the members is part of the database, so it is built before measuring anything.
+    history.rebuild()
+    file_bytes, index_bytes = database_bytes(path)
+    snapshot.DIRECTORY = os.path.join(directory, snapshot.DEFAULT_DIRECTORY)
+    member = core.Member.get_member_from_id(member_amount // 2)
+    serialized_tournament = db.TOURNAMENT_TABLES.get(doc_id=tournament_amount // 2)
+    tournament = core.unserialize_tournament(serialized_tournament)
+    controller = controllers.GlobalController(SilentView())
+    # A tournament read with TOURNAMENT_TABLES doesn't know its shard, so it is never given from the cache.
+    operations = {"Member.save": (member.save, None),
+                  "Tournament.save": (tournament.save, None),
+                  "unserialize_tournament": (lambda: core.unserialize_tournament(serialized_tournament), None)}
+    # The loads are measured with an empty cache (cold), then after the same load (warm), when the tournaments are
+    # given from the cache.
+    loads = {"load_tournament": lambda: core.Tournament.get_tournament(tournament.name),
+             "get_all_tournaments": core.Tournament.get_all_tournaments}
+    for name, load in loads.items():
+        operations[f"{name} (cold)"] = (load, cache.CACHE.clear)
+        operations[f"{name} (warm)"] = (load, load)
+    operations.update({"get_all_members": (core.Member.get_all_members, None),
+                       "get_member": (lambda: core.Member.get_member(member.name, member.surname), None),
+                       "display_tournaments": (controller.display_tournaments, None)})
+    report = {"scale": scale,
+              "compression": compression,
+              "members": member_amount,
+              "tournaments": tournament_amount,
+              "file_bytes": file_bytes,
+              "index_bytes": index_bytes,
+              "operations": {name: measure(operation, repeat, before)
+                             for name, (operation, before) in operations.items()}}
+    db.DATABASE.close()
+    return report
+
+
+def display(report, baseline=None):
+    """Print a report, with the ratio to a baseline report for each value if one is given."""
+    print(f"{report['scale']}: {report['members']} members, {report['tournaments']} tournaments, "
+          f"{report['file_bytes']} bytes and {report.get('index_bytes', 0)} bytes of indexes "
+          f"({report.get('compression') or 'uncompressed'})")
+    for name, values in report["operations"].items():
+        line = [f"{name:<30}"]
+        for key, value in values.items():
+            text = f"{key}={value:.6f}" if isinstance(value, float) else f"{key}={value}"
+            if baseline and baseline["operations"].get(name, {}).get(key):
+                text += f" (x{value / baseline['operations'][name][key]:.2f})"
+            line.append(text)
+        print("  ".join(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="club")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="a previous report to compare with")
+    parser.add_argument("--compression", choices=db.COMPRESSED_STORAGES)
+    arguments = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        report = run(arguments.scale, arguments.repeat, directory, arguments.compression)
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    display(report, baseline)
+    with open(arguments.output, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
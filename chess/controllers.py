@@ -1,8 +1,11 @@
 """Implement a class that will manage all interactions with the model"""
+import math
+import os
 import re
+import time
 from datetime import datetime
 
-from models import core, exceptions
+from models import cache, core, db, exceptions, exchange, feed, history, report, writer
 from models.translate import TRANSLATION
 
 VALIDATION_WORDS = TRANSLATION["yes"]
@@ -10,6 +13,12 @@ REFUSAL_WORDS = TRANSLATION["no"]
 SENTENCES = TRANSLATION["controller"]
 HEADERS = TRANSLATION["headers"]
 VALID_TIME_CONTROLS = TRANSLATION["valid_types"]
+VALID_SYSTEMS = TRANSLATION["valid_systems"]
+VALID_SHARDINGS = TRANSLATION["valid_shardings"]
+COLORS = TRANSLATION["colors"]
+PAIRING_TRACE = TRANSLATION["pairing_trace"]
+# Returned by check_entry in place of a problem when the game already has the result of the entry.
+ALREADY_APPLIED = "already_applied"
 
 
 def fix_input(function):
@@ -40,12 +49,18 @@ def fix_input(function):
         to_check = {"birthdate": check_date,
                     "discriminator": check_number,
                     "match_number": check_number,
+                    "round_number": check_number,
                     "max_round": check_number,
                     "ranking": check_number,
                     "participant_amount": check_number,
                     "result": check_result,
                     "date": check_date,
-                    "tournament_type": check_type
+                    "tournament_type": check_type,
+                    "time_budget": check_duration,
+                    "duration": check_duration,
+                    "places": check_number,
+                    "system": check_system,
+                    "criterion": check_sharding
                     }
         for key in kwargs:
             if key in to_check:
@@ -96,6 +111,52 @@ class Controller:
             self.view.display(SENTENCES["no_member"])
         return
 
+    @fix_input
+    def publish(self, directory=report.DEFAULT_DIRECTORY):
+        """Generate the static reports of all the tournaments that changed since the last publication."""
+        tournaments, rounds = report.publish(directory)
+        self.view.display(SENTENCES["published"](tournaments, rounds))
+        return
+
+    @fix_input
+    def member_history(self, *, name, surname):
+        """Display the results of a member in every tournament they played."""
+        member = self.choose_a_member(core.Member.get_member(name, surname))
+        if not member:
+            return
+        entries = history.member_history(member.identifiant)
+        if not entries:
+            self.view.display(SENTENCES["no_history"])
+            return
+        self.view.display(HEADERS["history_display"])
+        for entry in entries.values():
+            self.view.display(f"{entry['name']}   {entry['date']}   {entry['points']}")
+            for game in entry["games"]:
+                self.view.display(f"    Round {game['round']}   {COLORS[game['color']]}   {game['opponent_name']}   "
+                                  f"{game['score']}")
+        return
+
+    @fix_input
+    def head_to_head(self, *, name, surname, opponent_name, opponent_surname):
+        """Display all the games two members played against each other."""
+        member = self.choose_a_member(core.Member.get_member(name, surname))
+        if not member:
+            return
+        opponent = self.choose_a_member(core.Member.get_member(opponent_name, opponent_surname))
+        if not opponent:
+            return
+        games = history.head_to_head(member.identifiant, opponent.identifiant)
+        if not games:
+            self.view.display(SENTENCES["never_met"])
+            return
+        wins = len([game for _, game in games if game["points"] == 1])
+        losses = len([game for _, game in games if game["points"] == 0])
+        self.view.display(SENTENCES["head_to_head"](len(games), wins, len(games) - wins - losses, losses))
+        self.view.display(HEADERS["head_to_head_display"])
+        for tournament_name, game in games:
+            self.view.display(f"{tournament_name}   Round {game['round']}   {COLORS[game['color']]}   {game['score']}")
+        return
+
     def sort_check(self, elements, key):
         """Sort according to key if key is an attribute of all elements of a list."""
         if key is not None:
@@ -118,15 +179,24 @@ class GlobalController(Controller):
 
     @fix_input
     def add_tournament(self, *, name, place, date, max_round, participant_amount,
-                       tournament_type, description=""):
+                       tournament_type, description="", system=None):
         """Create a new tournament and return the controller that manages it."""
+        # The dates are only parsed when they are needed, so they are checked here.
+        if not check_date(date) or (system is not None and not check_system(system)):
+            raise ValueError
+        date = normalize_dates(date)
+        system = VALID_SYSTEMS[system.lower()] if system is not None else core.SWISS
         try:
             new_tournament = core.Tournament(name=name, place=place, date=date,
                                              max_round=max_round, participant_amount=participant_amount,
-                                             tournament_type=tournament_type, description=description)
+                                             tournament_type=tournament_type, description=description,
+                                             system=system)
         except exceptions.OddParticipantError:
             self.view.display(SENTENCES["odd_number"])
             return
+        except exceptions.InvalidRoundAmountError:
+            self.view.display(SENTENCES["invalid_round_amount"](int(participant_amount) - 1))
+            return
         else:
             if new_tournament.already_exist:
                 self.view.display(SENTENCES["tournament_already_exists"])
@@ -138,6 +208,10 @@ class GlobalController(Controller):
     @fix_input
     def add_member(self, *, name, surname, birthdate, gender, ranking):
         """Add a new member with all required fields and make sure they are unique."""
+        # The birthdate is only parsed when it is needed, so it is checked here.
+        if not check_date(birthdate):
+            raise ValueError
+        birthdate = normalize_dates(birthdate)
         new_member = core.Member(name=name, surname=surname, birthdate=birthdate, gender=gender, ranking=ranking)
         try:
             self.add_discriminator(new_member)
@@ -175,13 +249,8 @@ class GlobalController(Controller):
     @fix_input
     def display_tournaments(self):
         """Display all the tournaments."""
-        try:
-            tournaments = core.Tournament.get_all_tournaments()
-        except exceptions.InvalidTournamentError as inst:
-            self.view.display(SENTENCES["can't_charge_tournament_critical"](inst.problem))
-            return
-        tournaments_to_display = "\n".join([f"{i+1}) {tournament.to_display}"
-                                            for i, tournament in enumerate(tournaments)])
+        tournaments_to_display = "\n".join([f"{i+1}) {tournament}"
+                                            for i, tournament in enumerate(core.Tournament.get_all_headers())])
         if tournaments_to_display:
             self.view.display(HEADERS["tournament_display"])
             self.view.display(tournaments_to_display)
@@ -189,8 +258,37 @@ class GlobalController(Controller):
             self.view.display(SENTENCES["no_tournament"])
         return
 
+    @fix_input
+    def import_trf(self, *, file):
+        """Create a finished tournament and its missing members from a TRF file given by a federation."""
+        try:
+            serialized, created = exchange.import_trf(file)
+        except OSError:
+            self.view.display(SENTENCES["file_not_readable"](file))
+        except exceptions.InvalidTRFError as inst:
+            self.view.display(SENTENCES["invalid_trf"](inst.line_number))
+        except exceptions.OddParticipantError:
+            self.view.display(SENTENCES["odd_number_trf"])
+        except exceptions.TournamentAlreadyExistsError:
+            self.view.display(SENTENCES["tournament_already_exists"])
+        else:
+            self.view.display(SENTENCES["imported"](serialized["name"], serialized["participant_amount"], created))
+        return
+
+    @fix_input
+    def split_database(self, *, criterion):
+        """Split the tournaments of the database in several files, by season or by club, or gather them again."""
+        if not check_sharding(criterion):
+            raise ValueError
+        moved = db.reshard(VALID_SHARDINGS[criterion.lower()])
+        history.rebuild()
+        self.view.display(SENTENCES["database_split"](moved))
+        return
+
     def create_tournament_controller(self, tournament):
-        """Create a new controller for a tournament."""
+        """Create a new controller for a tournament. The tournament is going to be changed, so the cache must not give
+        it to anyone else."""
+        cache.CACHE.forget(tournament)
         new_controller = TournamentController(tournament, self.view)
         return new_controller
 
@@ -250,6 +348,19 @@ class TournamentController(Controller):
         super().__init__(view)
         self.tournament = tournament
 
+    def save_tournament(self, now=False):
+        """Save the tournament, warning the user if another terminal made incompatible changes. Return False if the
+        save was refused."""
+        try:
+            if now:
+                self.tournament.save_now()
+            else:
+                self.tournament.save()
+        except exceptions.ConflictError:
+            self.view.display(SENTENCES["save_conflict"])
+            return False
+        return True
+
     @fix_input
     def display_players(self, key=None):
         """Display all the players in the tournament."""
@@ -300,6 +411,59 @@ class TournamentController(Controller):
         self.games_to_display(1)
         return
 
+    @fix_input
+    def display_pairing_trace(self, round_number=None):
+        """Display how the pairing of a round (the current one by default) was made, phase by phase."""
+        if round_number is not None and not check_number(round_number):
+            raise ValueError
+        if len(self.tournament.rounds) == 0:
+            self.view.display(SENTENCES["no_games"])
+            return
+        if round_number is None:
+            round_number = len(self.tournament.rounds)
+        if int(round_number) > len(self.tournament.rounds):
+            self.view.display(SENTENCES["round_doesn't_exist"])
+            return
+        game_round = self.tournament.rounds[int(round_number) - 1]
+        trace = game_round.pairing_trace
+        if not trace:
+            self.view.display(SENTENCES["no_pairing_trace"])
+            return
+        if not game_round.pairing_optimal:
+            self.view.display(SENTENCES["pairing_not_optimal"])
+        self.view.display(HEADERS["pairing_trace_display"])
+        for entry in trace:
+            details = ", ".join([f"{PAIRING_TRACE['details'][key]}: {trace_value(value)}"
+                                 for key, value in entry.items() if key not in ("phase", "group", "seconds")])
+            self.view.display(f"{PAIRING_TRACE['phases'][entry['phase']]}   {entry.get('group', '-')}   "
+                              f"{entry['seconds']:.4f} s   {details}")
+        return
+
+    @fix_input
+    def who_can_win(self, places=3):
+        """Display the best and the worst place each player can still reach during the last round, and who can still
+        finish first or in the first places."""
+        if not check_number(places):
+            raise ValueError
+        places = int(places)
+        if not self.tournament.is_started:
+            self.view.display(SENTENCES["tournament_not_started"])
+            return
+        if len(self.tournament.rounds) < self.tournament.max_round:
+            self.view.display(SENTENCES["not_last_round"])
+            return
+        ranks = self.tournament.reachable_ranks()
+        self.view.display(HEADERS["reachable_ranks_display"])
+        for player, best, worst in ranks:
+            self.view.display(f"{player.name}   {player.points}   {best}   {worst}")
+        winners = [player.name for player, best, _ in ranks if best == 1]
+        contenders = [player.name for player, best, _ in ranks if best <= places]
+        qualified = [player.name for player, _, worst in ranks if worst <= places]
+        self.view.display(SENTENCES["can_still_win"](", ".join(winners)))
+        self.view.display(SENTENCES["can_reach_places"](places, ", ".join(contenders)))
+        self.view.display(SENTENCES["sure_of_places"](places, ", ".join(qualified) or "-"))
+        return
+
     def games_to_display(self, round_amount):
         """Display the games of certain rounds"""
         if len(self.tournament.rounds) == 0:
@@ -333,7 +497,7 @@ class TournamentController(Controller):
             else:
                 self.view.display(SENTENCES["has_been_added"](name.capitalize(),
                                                               surname.upper()))
-        self.tournament.save()
+        self.save_tournament()
         return
 
     @fix_input
@@ -351,7 +515,7 @@ class TournamentController(Controller):
                                                                  inst.problem_member.discriminator))
             else:
                 self.view.display(SENTENCES["has_been_removed"](name.capitalize(), surname.upper()))
-        self.tournament.save()
+        self.save_tournament()
         return
 
     @fix_input
@@ -379,14 +543,14 @@ class TournamentController(Controller):
             self.view.display(SENTENCES["tournament_started"])
         else:
             self.view.display(SENTENCES["tournament_launched"])
-            self.tournament.save()
+            self.save_tournament()
         return
 
     @fix_input
-    def next_round(self):
-        """Create the next round."""
+    def next_round(self, time_budget=None):
+        """Create the next round, spending at most time_budget seconds on the pairing if it is given."""
         try:
-            self.tournament.create_round()
+            self.tournament.create_round(float(time_budget) if time_budget is not None else None)
         except exceptions.PreviousRoundNotFinishedError:
             self.view.display(SENTENCES["round_not_finished"])
         except exceptions.TooManyRoundsError:
@@ -396,9 +560,11 @@ class TournamentController(Controller):
         else:
             self.view.display(SENTENCES["round_created"])
             game_round = self.tournament.rounds[-1]
+            if not game_round.pairing_optimal:
+                self.view.display(SENTENCES["pairing_not_optimal"])
             for game in game_round.games:
                 self.view.display(game.name)
-            self.tournament.save()
+            self.save_tournament()
         return
 
     @fix_input
@@ -412,7 +578,7 @@ class TournamentController(Controller):
             self.view.display(SENTENCES["round_already_finished"])
         else:
             self.view.display(SENTENCES["round_finished"])
-            self.tournament.save()
+            self.save_tournament()
         return
 
     @fix_input
@@ -434,7 +600,7 @@ class TournamentController(Controller):
                 if answer.lower() in VALIDATION_WORDS:
                     current_match.set_score(result)
                     self.view.display(SENTENCES["result_ok"])
-                    self.tournament.save()
+                    self.save_tournament()
                 elif answer.lower() not in REFUSAL_WORDS:
                     self.view.display(SENTENCES["invalid_result_answer"])
                 else:
@@ -442,6 +608,102 @@ class TournamentController(Controller):
 
         return
 
+    @fix_input
+    def give_all_results(self, results=None, file=None):
+        """Set the results of several matches of the current round with a single confirmation and a single save.
+
+        The results are given as "match_number result" separated by commas or new lines, directly or in a file."""
+        if file is not None:
+            try:
+                with open(file, encoding="utf-8") as results_file:
+                    results = results_file.read()
+            except OSError:
+                self.view.display(SENTENCES["file_not_readable"](file))
+                return
+        elif results is None:
+            results = self.view.ask_argument("results_give_all_results")
+        if not self.tournament.rounds:
+            self.view.display(SENTENCES["no_games"])
+            return
+        games = self.tournament.rounds[-1].games
+        results, errors, repeated = parse_results(results, games)
+        if errors:
+            self.view.display(SENTENCES["invalid_results"]("\n".join(errors)))
+            return
+        if repeated:
+            self.view.display(SENTENCES["entries_already_applied"](", ".join([str(number) for number in repeated])))
+        if not results:
+            self.view.display(SENTENCES["no_results"])
+            return
+        summary = "\n".join([f"{match_number}) {games[match_number - 1].name}    {result}"
+                             for match_number, result in results])
+        answer = self.view.ask(SENTENCES["validation_results"](summary))
+        if answer.lower() in VALIDATION_WORDS:
+            for match_number, result in results:
+                games[match_number - 1].set_score(result)
+            self.view.display(SENTENCES["results_ok"](len(results)))
+            self.save_tournament()
+        elif answer.lower() not in REFUSAL_WORDS:
+            self.view.display(SENTENCES["invalid_result_answer"])
+        else:
+            self.view.display(SENTENCES["result_not_ok"])
+        return
+
+    @fix_input
+    def follow_results(self, *, file, duration=None):
+        """Apply the results written in a file, or in the files of a directory, as they are written.
+
+        It stops when every game of the current round has a result, after duration seconds if it is given, or when
+        the user presses Ctrl+C. The results are saved together, at most feed.SAVE_INTERVAL seconds after they were
+        read."""
+        if duration is not None and not check_duration(duration):
+            raise ValueError
+        if not self.tournament.rounds:
+            self.view.display(SENTENCES["no_games"])
+            return
+        if not os.path.exists(file):
+            self.view.display(SENTENCES["file_not_readable"](file))
+            return
+        games = self.tournament.rounds[-1].games
+        results_feed = feed.ResultsFeed(file)
+        deadline = time.monotonic() + float(duration) if duration is not None else None
+        last_save = time.monotonic()
+        pending = applied = 0
+        self.view.display(SENTENCES["following_results"](file))
+        try:
+            while True:
+                for line in results_feed.read_lines():
+                    for entry in [entry.strip() for entry in line.split(",") if entry.strip()]:
+                        result, error = check_entry(entry, games)
+                        if error is ALREADY_APPLIED:
+                            # The file was read again from the start, for example after being rewritten.
+                            continue
+                        elif error:
+                            self.view.display(error)
+                        else:
+                            match_number, score = result
+                            games[match_number - 1].set_score(score)
+                            self.view.display(f"{match_number}) {games[match_number - 1].name}    {score}")
+                            pending += 1
+                complete = all([game.score != "0-0" for game in games])
+                if pending and (complete or time.monotonic() - last_save >= feed.SAVE_INTERVAL):
+                    self.save_tournament()
+                    applied += pending
+                    pending = 0
+                    last_save = time.monotonic()
+                self.view.flush(page=False)
+                if complete or (deadline is not None and time.monotonic() >= deadline):
+                    break
+                time.sleep(feed.POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pending:
+                self.save_tournament()
+                applied += pending
+        self.view.display(SENTENCES["results_followed"](applied))
+        return
+
     @fix_input
     def finish(self):
         """Finish the tournament and display the result."""
@@ -450,17 +712,33 @@ class TournamentController(Controller):
             self.view.display(HEADERS["result"])
             for i, player in enumerate(result):
                 self.view.display(f"{i+1}) {player.to_display}")
-            self.tournament.save()
+            self.save_tournament()
             return self.exit()
         else:
             self.view.display(SENTENCES["tournament_not_finished"])
             return
 
+    @fix_input
+    def export(self, directory=exchange.DEFAULT_DIRECTORY):
+        """Write the tournament as a TRF file and its games as a PGN file, to send them to a federation."""
+        if not self.tournament.is_started:
+            self.view.display(SENTENCES["tournament_not_started"])
+            return
+        trf_path, pgn_path = exchange.export(self.tournament, directory)
+        self.view.display(SENTENCES["exported"](trf_path, pgn_path))
+        return
+
     @fix_input
     def exit(self):
-        """Return to the main menu."""
+        """Return to the main menu, asking first if the changes that couldn't be saved can be dropped."""
+        # The save is made now, even in the background, to know if it is refused before leaving.
+        writer.flush()
+        if not self.save_tournament(now=True):
+            answer = self.view.ask(SENTENCES["drop_changes"])
+            if answer.lower() not in VALIDATION_WORDS:
+                self.view.display(SENTENCES["changes_kept"])
+                return
         self.view.display(SENTENCES["back_main_menu"])
-        self.tournament.save()
         return "exit"
 
 
@@ -481,12 +759,67 @@ def not_enough_argument(error):
     return arguments_missing
 
 
+def trace_value(value):
+    """Return a value recorded in a pairing trace as it is displayed."""
+    if isinstance(value, bool):
+        return VALIDATION_WORDS[0] if value else REFUSAL_WORDS[0]
+    elif isinstance(value, list):
+        return "/".join([str(element) for element in value])
+    return PAIRING_TRACE["reasons"].get(value, value) if isinstance(value, str) else value
+
+
 def check_result(result):
     """Return a boolean indicating if the input is a valid result or not."""
     valid_results = {"0-1", "1-0", "1/2-1/2"}
     return result in valid_results
 
 
+def parse_results(text, games):
+    """Return the (match number, result) pairs found in a text, the list of the problems found in it and the match
+    numbers given the result they already have, which are skipped.
+
+    The pairs are written "match_number result" and separated by commas or new lines. Every pair is checked against
+    the games of the round, so that no result is applied if one of them is wrong."""
+    results = []
+    errors = []
+    repeated = []
+    seen = set()
+    for entry in re.split(r"[,\n]", text):
+        entry = entry.strip()
+        if not entry:
+            continue
+        result, error = check_entry(entry, games, seen)
+        if error is ALREADY_APPLIED:
+            seen.add(result[0])
+            repeated.append(result[0])
+        elif error:
+            errors.append(error)
+        else:
+            seen.add(result[0])
+            results.append(result)
+    return results, errors, repeated
+
+
+def check_entry(entry, games, seen=()):
+    """Return the (match number, result) pair written in an entry and None, or None and the problem found in it. If the
+    game already has this result, the pair is returned with ALREADY_APPLIED instead of None.
+
+    seen holds the match numbers already given in the same text."""
+    parts = entry.split()
+    if len(parts) != 2 or not check_number(parts[0]) or not check_result(parts[1]):
+        return None, SENTENCES["invalid_entry"](entry)
+    match_number = int(parts[0])
+    if match_number > len(games):
+        return None, SENTENCES["entry_game_doesn't_exist"](match_number)
+    elif match_number in seen:
+        return None, SENTENCES["entry_duplicated"](match_number)
+    elif games[match_number - 1].score != "0-0":
+        if games[match_number - 1].score == parts[1]:
+            return (match_number, parts[1]), ALREADY_APPLIED
+        return None, SENTENCES["entry_already_has_score"](match_number)
+    return (match_number, parts[1]), None
+
+
 def check_date(value):
     """Return a boolean indicating if the input can be turned into one or several dates or not."""
     potential_dates = value.split()
@@ -498,6 +831,11 @@ def check_date(value):
     return True
 
 
+def normalize_dates(value):
+    """Return valid dates written with the format used in the database."""
+    return " ".join([datetime.strptime(date, "%d/%m/%Y").strftime("%d/%m/%Y") for date in value.split()])
+
+
 def check_number(value):
     """Return a boolean indicating if the input can be turned into an integer or not."""
     try:
@@ -508,6 +846,26 @@ def check_number(value):
         return int(value) > 0
 
 
+def check_duration(value):
+    """Return a boolean indicating if the input is a positive and finite amount of seconds or not."""
+    try:
+        float(value)
+    except ValueError:
+        return False
+    else:
+        return math.isfinite(float(value)) and float(value) > 0
+
+
+def check_system(value):
+    """Return a boolean indicating if the input is a valid pairing system."""
+    return value.lower() in VALID_SYSTEMS
+
+
+def check_sharding(value):
+    """Return a boolean indicating if the input is a valid way to split the database."""
+    return value.lower() in VALID_SHARDINGS
+
+
 def check_type(value):
     """Return a boolean indicating if the input is a valid type of time control."""
     return value.lower() in VALID_TIME_CONTROLS
@@ -0,0 +1,76 @@
+"""Keep the tournaments unserialized from the database, to give them again while their document doesn't change.
+
+Each tournament is kept with the hash of the document it was built from and the checksum of the members (whose names
+and rankings it displays), and is only given again while both are the same. The tournaments given are shared by every
+caller, so they must only be read: a tournament that is going to be changed is forgotten first (see forget), so that
+its changes are never given to another caller, even if they are never saved. The least recently used tournaments are
+forgotten when the kept tournaments would take more than MAX_SIZE."""
+import collections
+import hashlib
+import pickle
+import threading
+
+# The memory the kept tournaments can take, in bytes, estimated from the size of their pickled documents: a tournament
+# with all its rounds takes about 10 times the size of its pickled document.
+MAX_SIZE = 64 * 1024 * 1024
+SIZE_FACTOR = 10
+
+
+def document_hash(serialized):
+    """Return the hash of a serialized tournament and its estimated size once unserialized.
+
+    The hash is only kept in memory, so it is made from the pickled document, about 4 times faster than from JSON."""
+    content = pickle.dumps(serialized, protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.blake2b(content, digest_size=16).digest(), len(content) * SIZE_FACTOR
+
+
+class TournamentCache:
+    """The tournaments by key, with the signature of what they were built from, the least recently used first."""
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = self.misses = 0
+        # The background writer unserializes tournaments while merging them.
+        self.lock = threading.Lock()
+        # (signature, tournament, estimated size) by key.
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, signature):
+        """Return the tournament kept for key if it was built with the same signature, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, size, tournament):
+        """Keep a tournament in place of the previous version of its key, forgetting the least recently used ones
+        beyond the maximum size."""
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+            if size > self.max_size:
+                return
+            self.entries[key] = (signature, tournament, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self.entries.popitem(last=False)[1][2]
+
+    def forget(self, tournament):
+        """Stop giving a tournament, which is going to be changed or couldn't be saved."""
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry[1] is tournament:
+                    self.size -= self.entries.pop(key)[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+CACHE = TournamentCache()
@@ -1,34 +1,142 @@
 """Implement all classes required to create and play a complete tournament"""
+import os
 from time import time
 from datetime import datetime
 from random import sample
 
-from . import pairing, exceptions, db
+from . import pairing, exceptions, cache, db, history, snapshot, writer
+
+# Version 1 saved the opponents of each player as a dictionary keyed by their full names. Version 2 saves them as a
+# list of indexes in the players, with one element per game played.
+SCHEMA_VERSION = 2
+# The whole pairing trace of each round is saved if True. Otherwise only its summary (see pairing.summarize) is saved,
+# the whole trace being kept while the round stays loaded.
+SAVE_PAIRING_TRACE = False
+# The smallest amount of tournaments sent at once to a process of the pool, below which sending them costs more than
+# it saves.
+MIN_CHUNK_SIZE = 8
+SWISS = "swiss"
+ROUND_ROBIN = "round_robin"
+
+
+class LazyDate:
+    """An attribute given as text, that is only parsed into a datetime (or a list of datetimes if several is True)
+    the first time it is read.
+
+    Objects are often loaded from the database only to be listed or saved again, which doesn't require the parsed
+    value. The text is always available in the attribute <name>_text, and is updated when a datetime is assigned."""
+
+    def __init__(self, date_format, several=False):
+        self.date_format = date_format
+        self.several = several
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.text_name = f"{name}_text"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if self.name not in instance.__dict__:
+            text = instance.__dict__[self.text_name]
+            if self.several:
+                instance.__dict__[self.name] = [datetime.strptime(date, self.date_format) for date in text.split()]
+            else:
+                instance.__dict__[self.name] = datetime.strptime(text, self.date_format)
+        return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        if isinstance(value, str):
+            instance.__dict__.pop(self.name, None)
+            instance.__dict__[self.text_name] = value
+        else:
+            instance.__dict__[self.name] = value
+            if self.several:
+                instance.__dict__[self.text_name] = " ".join([date.strftime(self.date_format) for date in value])
+            else:
+                instance.__dict__[self.text_name] = value.strftime(self.date_format)
+
+
+class LazyRounds:
+    """The rounds of a tournament, each round loaded from the database being unserialized only when it is accessed.
+
+    Most commands only use the last round, and the points and opponents of the players are saved with them, so the
+    older rounds are rarely needed. A round that was never unserialized is saved again as it was loaded."""
+
+    def __init__(self, serialized_rounds=None, players=None):
+        self.serialized_rounds = list(serialized_rounds) if serialized_rounds else []
+        self.loaded_rounds = [None] * len(self.serialized_rounds)
+        self.players = players
+
+    def __len__(self):
+        return len(self.loaded_rounds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self.loaded_rounds[index] is None:
+            self.loaded_rounds[index] = unserialize_round(self.serialized_rounds[index], self.players)
+        return self.loaded_rounds[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def stream(self):
+        """Yield every round without keeping the ones that weren't already unserialized, to read them all once."""
+        for serialized, game_round in zip(self.serialized_rounds, self.loaded_rounds):
+            yield unserialize_round(serialized, self.players) if game_round is None else game_round
+
+    def load_all(self):
+        """Unserialize all the rounds, forgetting their serialized version, which isn't needed anymore."""
+        for i in range(len(self)):
+            self[i]
+        self.serialized_rounds = [None] * len(self)
+
+    def append(self, game_round):
+        self.serialized_rounds.append(None)
+        self.loaded_rounds.append(game_round)
+
+    def to_dict(self, players):
+        """Serialize all the rounds, without unserializing those that weren't accessed."""
+        return [serialized if game_round is None else game_round.to_dict(players)
+                for serialized, game_round in zip(self.serialized_rounds, self.loaded_rounds)]
 
 
 class Tournament:
     """Class representing a complete Tournament."""
+    date = LazyDate("%d/%m/%Y", several=True)
 
     def __init__(self, *, name, place, date, max_round, participant_amount, tournament_type, description,
-                 participants=None, players=None, rounds=None, is_started=False):
+                 participants=None, players=None, rounds=None, is_started=False, version=0, system=SWISS,
+                 schedule=None):
         self.name = name.capitalize()
         self.place = place
         # the dates are given as a string in the format dd/mm/yyyy dd/mm/yyyy_.... during the creation of the
         # tournament.
-        self.date = [datetime.strptime(date, "%d/%m/%Y") for date in date.split()]
+        self.date = date
         self.max_round = int(max_round)
         self.type = tournament_type.capitalize()
         self.description = description.capitalize()
         self.participant_amount = int(participant_amount)
         if self.participant_amount % 2 != 0:
             raise exceptions.OddParticipantError
+        self.system = system
+        # In a round robin, everyone plays everyone once (or twice, with the colours reversed the second time).
+        if self.system == ROUND_ROBIN and self.max_round not in (self.participant_amount - 1,
+                                                                 2 * (self.participant_amount - 1)):
+            raise exceptions.InvalidRoundAmountError
+        # The games of every round of a round robin, as (white, black) indexes in players, computed at the start.
+        self.schedule = schedule
 
         self.participants = participants if type(participants) == list else []
         self.players = players if type(players) == list else []
-        self.rounds = rounds if type(rounds) == list else []
+        self.rounds = rounds if isinstance(rounds, LazyRounds) else LazyRounds()
         # The user COULD send something for those three attributes. So if they do, it's cancelled
         # because it can't be a list (it's necessarily a string). The user must not be able to change those values.
         self.is_started = is_started
+        # The number of times the tournament has been saved, used to detect changes made by another process.
+        self.version = version
 
     def add_participant(self, member):
         """Add a participant for the tournament."""
@@ -60,10 +168,21 @@ class Tournament:
             raise exceptions.AlreadyStartedError
         else:
             self.players = [Player(**{"member": member}) for member in self.participants]
+            if self.system == ROUND_ROBIN:
+                self.schedule = self.make_schedule()
             self.is_started = True
 
-    def create_round(self):
-        """Create a round."""
+    def make_schedule(self):
+        """Return the games of all the rounds of a round robin, the players being seeded by ranking."""
+        seeds = sorted(range(len(self.players)), key=lambda i: self.players[i].member.ranking)
+        table = pairing.berger_table(len(self.players))
+        schedule = [[[seeds[white], seeds[black]] for white, black in games] for games in table]
+        if self.max_round > len(table):
+            schedule += [[[black, white] for white, black in games] for games in schedule]
+        return schedule
+
+    def create_round(self, time_budget=None):
+        """Create a round, spending at most time_budget seconds on the pairing if it is given."""
         if not self.is_started:
             raise exceptions.TournamentNotStartedError
         if len(self.rounds) == 0 or (len(self.rounds) < self.max_round and self.rounds[-1].finished):
@@ -72,7 +191,10 @@ class Tournament:
                               players=self.players,
                               starting_time=starting_time)
             self.rounds.append(new_round)
-            new_round.create_games()
+            if self.system == ROUND_ROBIN:
+                new_round.create_scheduled_games(self.schedule[new_round.number - 1])
+            else:
+                new_round.create_games(time_budget)
         elif not self.rounds[-1].finished:
             raise exceptions.PreviousRoundNotFinishedError
         elif len(self.rounds) >= self.max_round:
@@ -84,15 +206,52 @@ class Tournament:
         players = sorted(self.players, key=lambda player: player.member.ranking)
         return sorted(players, key=lambda player: player.points, reverse=True)
 
+    def reachable_ranks(self):
+        """Return the best and the worst rank in result that each player can still reach, as (player, best, worst)
+        in the order of result, given the games of the current round that have no result yet.
+
+        A game only changes the points of its two players, so the results of the games can be chosen one by one: the
+        best rank of a player is reached when they win their game and every other game ends with the result putting
+        the fewest of its players ahead of them. The worst rank is found the same way, with the player losing."""
+        order = {id(player): (player.member.ranking, i) for i, player in enumerate(self.players)}
+        unplayed = [game for game in self.rounds[-1].games if game.score == "0-0"] if self.rounds else []
+        waiting = [player for player in self.players
+                   if all([player not in (game.white_player, game.black_player) for game in unplayed])]
+
+        def is_ahead(other, other_points, player, points):
+            return other_points > points or (other_points == points and order[id(other)] < order[id(player)])
+
+        def rank(player, best):
+            outcomes = {}
+            for game in unplayed:
+                if player in (game.white_player, game.black_player):
+                    won = (game.white_player is player) == best
+                    outcomes[id(game)] = [(1, 0) if won else (0, 1)]
+                else:
+                    outcomes[id(game)] = [(1, 0), (0, 1), (0.5, 0.5)]
+            own = next((game for game in unplayed if player in (game.white_player, game.black_player)), None)
+            points = player.points + (1 if own is not None and best else 0)
+            choose = min if best else max
+            ahead = sum([is_ahead(other, other.points, player, points) for other in waiting if other is not player])
+            for game in unplayed:
+                ahead += choose([sum([is_ahead(other, other.points + gained, player, points)
+                                      for other, gained in ((game.white_player, white), (game.black_player, black))
+                                      if other is not player])
+                                 for white, black in outcomes[id(game)]])
+            return ahead + 1
+
+        return [(player, rank(player, True), rank(player, False)) for player in self.result]
+
     @property
     def to_dict(self):
         """Return a serialized instance of a tournament."""
         participants_index = [participant.identifiant for participant in self.participants]
-        serialized_rounds = [game_round.to_dict(self.players) for game_round in self.rounds]
-        serialized_players = [player.to_dict(self.participants) for player in self.players]
+        serialized_rounds = self.rounds.to_dict(self.players)
+        player_indexes = {player.name: i for i, player in enumerate(self.players)}
+        serialized_players = [player.to_dict(self.participants, player_indexes) for player in self.players]
         serialized_tournament = {"name": self.name,
                                  "place": self.place,
-                                 "date": " ".join([date.strftime("%d/%m/%Y") for date in self.date]),
+                                 "date": self.date_text,
                                  "max_round": self.max_round,
                                  "tournament_type": self.type,
                                  "description": self.description,
@@ -100,71 +259,147 @@ class Tournament:
                                  "participants": participants_index,
                                  "rounds": serialized_rounds,
                                  "players": serialized_players,
-                                 "is_started": self.is_started}
+                                 "is_started": self.is_started,
+                                 "version": self.version,
+                                 "system": self.system,
+                                 "schedule": self.schedule,
+                                 "schema": SCHEMA_VERSION}
         return serialized_tournament
 
+    @property
+    def db_query(self):
+        """The query finding the tournament in the database."""
+        return ((db.QUERY.name == self.name) &
+                (db.QUERY.place == self.place) &
+                (db.QUERY.date == self.date_text))
+
+    @property
+    def shard(self):
+        """The database shard the tournament is saved in."""
+        return db.shard_of({"date": self.date_text, "place": self.place})
+
     def save(self):
-        """Add or update a tournament in the database."""
-        db.TOURNAMENT_TABLES.upsert(self.to_dict, ((db.QUERY.name == self.name) &
-                                                   (db.QUERY.place == self.place) &
-                                                   (db.QUERY.date == " ".join([date.strftime("%d/%m/%Y")
-                                                                               for date in self.date]))))
+        """Add or update a tournament in the database, now or in the background if the writer is running. A tournament
+        that was never saved is always saved now, so that it has its place in the database before being read again."""
+        if writer.WRITER is not None and self.version > 0:
+            writer.WRITER.request(self)
+        else:
+            self.save_now()
+
+    def save_now(self):
+        """Add or update a tournament in the database.
+
+        If the tournament was saved by another process since it was loaded, the changes of the other process are
+        merged, in the database and in the tournament. If they can't be, the ConflictError is raised, the tournament
+        keeps its version and it is forgotten by the cache, since its changes aren't in the database."""
+        pending_save = self.pending_save()
+        try:
+            pending_save.write()
+        except exceptions.ConflictError:
+            self.version = pending_save.base_version
+            cache.CACHE.forget(self)
+            raise
+        if pending_save.merged:
+            self.merge(pending_save.serialized)
+
+    def pending_save(self):
+        """Return what the tournament has to save, taking its next version."""
+        pending_save = TournamentSave(self, self.version)
+        self.version += 1
+        return pending_save
+
+    def merge(self, serialized):
+        """Add the results found in another version of the tournament.
+
+        Only results can be merged: if the other version has different participants or rounds, or gives another
+        result to a game, a ConflictError is raised."""
+        other = unserialize_tournament(serialized)
+        if (other.participants != self.participants or other.is_started != self.is_started
+                or len(other.rounds) != len(self.rounds)):
+            raise exceptions.ConflictError
+        for own_round, other_round in zip(self.rounds, other.rounds):
+            if [game.name for game in own_round.games] != [game.name for game in other_round.games]:
+                raise exceptions.ConflictError
+            for own_game, other_game in zip(own_round.games, other_round.games):
+                if other_game.score != own_game.score and own_game.score != "0-0" and other_game.score != "0-0":
+                    raise exceptions.ConflictError
+        for own_round, other_round in zip(self.rounds, other.rounds):
+            for own_game, other_game in zip(own_round.games, other_round.games):
+                if own_game.score == "0-0" and other_game.score != "0-0":
+                    own_game.set_score(other_game.score)
+            if other_round.finished and not own_round.finished:
+                own_round.finished = True
+                own_round.ending_time = other_round.ending_time
+        self.version = other.version
 
     @property
     def already_exist(self):
         """Return a boolean determining if the tournament already exists."""
-        return db.TOURNAMENT_TABLES.count((db.QUERY.name == self.name) &
-                                          (db.QUERY.place == self.place) &
-                                          (db.QUERY.date == " ".join([date.strftime("%d/%m/%Y")
-                                                                      for date in self.date]))) != 0
+        return self.shard.tournaments.count(self.db_query) != 0
 
     @classmethod
     def get_tournament(cls, name: str):
-        """Return all tournaments with a specific name."""
-        return [unserialize_tournament(tournament) for tournament in
-                db.TOURNAMENT_TABLES.search(db.QUERY.name == name.capitalize())]
+        """Return all tournaments with a specific name, from all the shards."""
+        return [unserialize_tournament(tournament) for tournament in db.search_tournaments(name=name.capitalize())]
 
     @classmethod
-    def get_all_tournaments(cls):
-        """Return all tournaments in the database."""
-        return [unserialize_tournament(tournament) for tournament in db.TOURNAMENT_TABLES.all()]
+    def get_all_tournaments(cls, workers=None):
+        """Return all tournaments in the database, from all the shards, with all their rounds."""
+        return load_tournaments(workers=workers)
+
+    @classmethod
+    def get_all_headers(cls):
+        """Return the lines displaying all the tournaments in the database, read from the indexes when possible."""
+        return [header_to_display(header) for header in db.tournament_headers()]
 
     @property
     def to_display(self):
         """A string that contains all relevant data of the tournament to be displayed."""
-        return "   ".join([self.name,
-                           self.place,
-                           " et ".join([date.strftime("%d/%m/%Y") for date in self.date]),
-                           self.type,
-                           self.description])
+        return header_to_display({"name": self.name, "place": self.place, "date": self.date_text,
+                                  "tournament_type": self.type, "description": self.description})
 
 
 class Round:
     """Class representing a round."""
+    starting_time = LazyDate("%H:%M")
+    ending_time = LazyDate("%H:%M")
+
     def __init__(self, *,  players, round_number, starting_time,
-                 games=None, ending_time="00:00", finished=False):
+                 games=None, ending_time="00:00", finished=False, pairing_trace=None, pairing_optimal=True):
         self.players = players
         self.number = int(round_number)
-        self.starting_time = datetime.strptime(starting_time, "%H:%M")
+        self.starting_time = starting_time
 
         self.name = f"Round {self.number}"
 
         self.games = games if games else []
-        self.ending_time = datetime.strptime(ending_time, "%H:%M")
+        self.ending_time = ending_time
         self.finished = finished
+        # False when the pairing search was stopped by its time budget before finding the best pairing.
+        self.pairing_optimal = pairing_optimal
+        # The phases of the pairing of the round, as recorded by the functions of pairing.py.
+        self.pairing_trace = pairing_trace if pairing_trace else []
 
-    def create_games(self):
+    def create_games(self, time_budget=None):
         """Create all games for the round."""
         players = sorted(self.players, key=lambda player: player.member.ranking)
         ecart = len(players) // 2
         if self.number == 1:
-            for i in range(ecart):
-                self.games.append(Game(**{"players": (players[i], players[i + ecart])}))
+            with pairing.traced(self.pairing_trace, "ranking_halves", players=len(players)):
+                for i in range(ecart):
+                    self.games.append(Game(**{"players": (players[i], players[i + ecart])}))
         else:
             players = sorted(players, key=lambda joueur: joueur.points, reverse=True)
-            for pair in make_pairs_unique(create_pairs(players)):
+            pairs, self.pairing_optimal = create_pairs(players, time_budget, self.pairing_trace)
+            for pair in make_pairs_unique(pairs):
                 self.games.append(Game(players=(pair[0], pair[1])))
 
+    def create_scheduled_games(self, games):
+        """Create the games of the round from (white, black) indexes in players."""
+        with pairing.traced(self.pairing_trace, "berger_schedule", players=len(self.players)):
+            self.games = [Game(new=False, white_player=self.players[white], black_player=self.players[black])
+                          for white, black in games]
+
     def finish(self):
         """Check that all games are over and get the time the round ended at."""
         if self.finished:
@@ -178,18 +413,21 @@ class Round:
     def to_dict(self, players):
         """Serialize an instance of a round."""
         serialized = {"round_number": self.number,
-                      "starting_time": self.starting_time.strftime("%H:%M"),
-                      "ending_time": self.ending_time.strftime("%H:%M"),
+                      "starting_time": self.starting_time_text,
+                      "ending_time": self.ending_time_text,
                       "finished": self.finished,
-                      "games": [game.to_dict(players) for game in self.games]}
+                      "games": [game.to_dict(players) for game in self.games],
+                      "pairing_trace": (self.pairing_trace if SAVE_PAIRING_TRACE
+                                        else pairing.summarize(self.pairing_trace)),
+                      "pairing_optimal": self.pairing_optimal}
         return serialized
 
     @property
     def to_display(self):
         """A string that contains all relevant data of the round to be displayed."""
         games = '\n'.join([game.to_display for game in self.games])
-        return f"{self.name}    a commencé à {self.starting_time.strftime('%H:%M')}   " \
-               f"a fini à {self.ending_time.strftime('%H:%M')}\n{games}"
+        return f"{self.name}    a commencé à {self.starting_time_text}   " \
+               f"a fini à {self.ending_time_text}\n{games}"
 
 
 class Game:
@@ -239,20 +477,24 @@ class Game:
 
 class Member:
     """Represent a member of the chess club."""
+    birthdate = LazyDate("%d/%m/%Y")
 
     def __init__(self, surname: str, name: str, birthdate, gender, ranking, discriminator=0):
         self.surname = surname.upper()
         self.name = name.capitalize()
-        self.birthdate = datetime.strptime(birthdate, "%d/%m/%Y")
+        self.birthdate = birthdate
         self.gender = gender.capitalize()
         self.ranking = int(ranking)
         self.discriminator = discriminator
+        # The identifiant in the database, once it is known.
+        self.doc_id = None
 
     # Changing the way equality is defined so that we compare all the attributes instead of the memory address.
-    # This makes it much easier to check for a member already participating in a tournament
+    # This makes it much easier to check for a member already participating in a tournament. The serialized
+    # attributes are compared since the birthdate may have been parsed for only one of the members.
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return self.to_dict == other.to_dict
         else:
             return False
 
@@ -264,32 +506,45 @@ class Member:
         """Serialize an instance of a member."""
         serialized_member = {"surname": self.surname,
                              "name": self.name,
-                             "birthdate": self.birthdate.strftime("%d/%m/%Y"),
+                             "birthdate": self.birthdate_text,
                              "gender": self.gender,
                              "ranking": self.ranking,
                              "discriminator": self.discriminator}
         return serialized_member
 
     def save(self):
+        """Add or update a member in the database, now or in the background if the writer is running. A new member is
+        always saved now, so that it has its identifiant."""
+        if writer.WRITER is not None and self.doc_id is not None:
+            writer.WRITER.request(self)
+        else:
+            self.save_now()
+
+    def save_now(self):
         """Add or update a member in the database."""
-        db.MEMBER_TABLES.upsert(self.to_dict, ((db.QUERY.surname == self.surname) &
-                                               (db.QUERY.name == self.name) &
-                                               (db.QUERY.discriminator == self.discriminator)))
+        self.doc_id = self.pending_save().write()[0]
+
+    def pending_save(self):
+        """Return what the member has to save."""
+        return MemberSave(self)
 
     @property
     def identifiant(self):
-        """The unique identifiant in the database."""
-        result = db.MEMBER_TABLES.get((db.QUERY.surname == self.surname) &
-                                      (db.QUERY.name == self.name) &
-                                      (db.QUERY.discriminator == self.discriminator))
-        return result.doc_id
+        """The unique identifiant in the database.
+
+        It is kept after the first search since members are never removed and never change name."""
+        if self.doc_id is None:
+            result = [member for member in db.members_named(self.surname, self.name)
+                      if member["discriminator"] == self.discriminator][0]
+            self.doc_id = result.doc_id
+        return self.doc_id
 
     @property
     def to_display(self):
         """Return a string that contains all relevant data of the member to be displayed."""
         return "   ".join([self.surname,
                            self.name,
-                           self.birthdate.strftime("%d/%m/%Y"),
+                           self.birthdate_text,
                            self.gender,
                            str(self.ranking),
                            str(self.discriminator)])
@@ -297,33 +552,39 @@ class Member:
     @property
     def already_exist(self):
         """Return the number of members in the database that have the same name and surname."""
-        return db.MEMBER_TABLES.count((db.QUERY.surname == self.surname) &
-                                      (db.QUERY.name == self.name))
+        return len(db.members_named(self.surname, self.name))
 
     @classmethod
     def get_member(cls, name: str, surname: str, discriminator=None):
         """Return all the members with a specific name and surname in the database."""
+        members = db.members_named(surname.upper(), name.capitalize())
         if discriminator:
-            return [Member(**member) for member in db.MEMBER_TABLES.search((db.QUERY.name == name.capitalize()) &
-                                                                           (db.QUERY.surname == surname.upper()) &
-                                                                           (db.QUERY.discriminator == discriminator))]
-        else:
-            return [Member(**member) for member in db.MEMBER_TABLES.search((db.QUERY.name == name.capitalize()) &
-                                                                           (db.QUERY.surname == surname.upper()))]
+            members = [member for member in members if member["discriminator"] == discriminator]
+        return [unserialize_member(member) for member in members]
 
     @classmethod
     def get_member_from_id(cls, identifiant):
         """Return a member from the identifiant in the database."""
-        if db.MEMBER_TABLES.contains(doc_id=identifiant):
-            member = db.MEMBER_TABLES.get(doc_id=identifiant)
-        else:
+        member = db.get_members([identifiant])[0]
+        if member is None:
             raise exceptions.NotInDatabaseError
-        return Member(**member)
+        return unserialize_member(member)
+
+    @classmethod
+    def get_members_from_ids(cls, identifiants):
+        """Return the members from a list of identifiants in the database, reading it only once."""
+        members = db.get_members(identifiants)
+        if None in members:
+            raise exceptions.NotInDatabaseError
+        members = [Member(**member) for member in members]
+        for member, identifiant in zip(members, identifiants):
+            member.doc_id = identifiant
+        return members
 
     @classmethod
     def get_all_members(cls):
         """Return all the members in the database."""
-        return [Member(**member) for member in db.MEMBER_TABLES.all()]
+        return [unserialize_member(member) for member in db.MEMBER_TABLES.all()]
 
 
 class Player:
@@ -334,10 +595,13 @@ class Player:
         self.people_played_against = people_played_against if people_played_against else {}
         self.points = points
 
-    def to_dict(self, participants):
-        """Serialize an instance of a player."""
+    def to_dict(self, participants, player_indexes):
+        """Serialize an instance of a player.
+
+        player_indexes gives the index of each player of the tournament from their name."""
+        opponents = [player_indexes[name] for name, times in self.people_played_against.items() for _ in range(times)]
         serialized_player = {"member_index": participants.index(self.member),
-                             "people_played_against": self.people_played_against,
+                             "opponents": opponents,
                              "points": self.points}
         return serialized_player
 
@@ -373,21 +637,142 @@ class Player:
         return "   ".join([self.name, str(self.points)])
 
 
+class TournamentSave:
+    """What a tournament has to save, taken when the save is requested, so that it can be written later (by the
+    background writer) without reading the tournament, which may have changed since.
+
+    base_version is the version the tournament had when it was loaded or last saved: if the stored tournament has
+    another version, it was saved by another process, and its changes are merged before writing. The merged document
+    is kept in serialized, with merged set to True, to be merged in the tournament too."""
+    table = "tournaments"
+
+    def __init__(self, tournament, base_version):
+        self.base_version = base_version
+        self.serialized = dict(tournament.to_dict, version=base_version + 1)
+        self.members = [participant.to_dict for participant in tournament.participants]
+        self.published = snapshot.make_snapshot(tournament)
+        self.fields = {"name": tournament.name, "place": tournament.place, "date": tournament.date_text}
+        self.key = (self.table, tournament.name, tournament.place, tournament.date_text)
+        self.path = db.shard_of(self.fields).path
+        self.merged = False
+
+    def follow(self, previous):
+        """Replace a previous save of the same tournament that wasn't written yet."""
+        self.base_version = previous.base_version
+
+    def write(self):
+        """Add or update the tournament in the database. The database and the shard of the tournament stay locked
+        between the check of the version and the write. The history of the participants and the snapshot for the
+        spectators are updated at the same time."""
+        query = (db.QUERY.name == self.fields["name"]) & (db.QUERY.place == self.fields["place"]) & \
+            (db.QUERY.date == self.fields["date"])
+        with db.LOCK:
+            shard = db.shard_of(self.fields)
+            with shard.lock:
+                stored = shard.tournaments.get(query)
+                if stored is not None and stored.get("version", 0) != self.base_version:
+                    participants = [Member(**member) for member in self.members]
+                    for participant, identifiant in zip(participants, self.serialized["participants"]):
+                        participant.doc_id = identifiant
+                    tournament = unserialize_tournament_with(self.serialized, participants)
+                    tournament.merge(stored)
+                    tournament.version += 1
+                    self.serialized = tournament.to_dict
+                    self.published = snapshot.make_snapshot(tournament)
+                    self.merged = True
+                doc_id = write_tournament(shard, self.serialized, self.members,
+                                          stored.doc_id if stored is not None else None)
+            snapshot.write_snapshot(self.published, shard.tournament_key(doc_id))
+        return [doc_id]
+
+
+def write_tournament(shard, serialized, serialized_members, doc_id=None):
+    """Write a serialized tournament in its shard, as doc_id or as a new document, with the history of the
+    participants whose results changed, and return its doc_id. The database and the shard must be locked.
+
+    In the main database, the tournament and the history are written at once."""
+    tournament_key = shard.tournament_key(doc_id) if doc_id is not None else None
+    entries = history.changed_entries(tournament_key, history.tournament_entries(serialized, serialized_members))
+    written = []
+
+    def write(table):
+        written.append(doc_id if doc_id is not None else max(table, default=0) + 1)
+        table[written[0]] = dict(serialized)
+
+    def written_key():
+        return shard.tournament_key(written[0])
+
+    updaters = [("tournaments", write)]
+    if entries and shard is db.MAIN_SHARD:
+        updaters.append(("history", history.entries_updater(written_key, entries)))
+    db.update_tables(shard, updaters)
+    if entries and shard is not db.MAIN_SHARD:
+        db.update_tables(db.MAIN_SHARD, [("history", history.entries_updater(written_key(), entries))])
+    history.mark_built_if_complete()
+    return written[0]
+
+
+class MemberSave:
+    """What a member has to save, taken when the save is requested."""
+    table = "members"
+
+    def __init__(self, member):
+        self.serialized = member.to_dict
+        self.fields = {"surname": member.surname, "name": member.name, "discriminator": member.discriminator}
+        self.key = (self.table, member.surname, member.name, member.discriminator)
+        self.path = db.MAIN_SHARD.path
+        self.merged = False
+
+    def follow(self, previous):
+        """Replace a previous save of the same member that wasn't written yet."""
+
+    def write(self):
+        """Add or update the member in the database, returning its doc_id in a list."""
+        with db.LOCK:
+            return db.MEMBER_TABLES.upsert(self.serialized, ((db.QUERY.surname == self.fields["surname"]) &
+                                                             (db.QUERY.name == self.fields["name"]) &
+                                                             (db.QUERY.discriminator == self.fields["discriminator"])))
+
+
+def header_to_display(header):
+    """Return the line displaying a tournament from its name, place, date, type and description."""
+    return "   ".join([header["name"],
+                       header["place"],
+                       " et ".join(header["date"].split()),
+                       header["tournament_type"],
+                       header["description"]])
+
+
 def unserialize_member(serialized):
-    """Create an instance of a member from a dictionary."""
-    return Member(**serialized)
+    """Create an instance of a member from a dictionary, keeping its identifiant if it comes from the database."""
+    member = Member(**serialized)
+    member.doc_id = getattr(serialized, "doc_id", None)
+    return member
 
 
 def unserialize_player(serialized, participants):
     """Create an instance of a player from a dictionary.
 
     It should only be used when creating/loading an instance of a tournament. It also requires the list of participants
-    in the tournament."""
+    in the tournament. The opponents of players saved with the version 2 of the schema are added afterwards by
+    unserialize_players, since they require all the players."""
     return Player(member=participants[serialized["member_index"]],
-                  people_played_against=serialized["people_played_against"],
+                  people_played_against=serialized.get("people_played_against"),
                   points=serialized["points"])
 
 
+def unserialize_players(serialized_players, participants):
+    """Create the instances of all the players of a tournament from a list of dictionaries.
+
+    Players saved with the version 1 of the schema already have their opponents by name. They are migrated to the
+    version 2 the next time the tournament is saved."""
+    players = [unserialize_player(player, participants) for player in serialized_players]
+    for player, serialized in zip(players, serialized_players):
+        for opponent in serialized.get("opponents", []):
+            player.played_against(players[opponent])
+    return players
+
+
 def unserialize_game(serialized, players):
     """Create an instance of a game from a dictionary.
 
@@ -406,39 +791,151 @@ def unserialize_round(serialized, players):
     in the tournament."""
     return Round(players=players, round_number=serialized["round_number"], starting_time=serialized["starting_time"],
                  games=[unserialize_game(game, players) for game in serialized["games"]],
-                 ending_time=serialized["ending_time"], finished=serialized["finished"])
+                 ending_time=serialized["ending_time"], finished=serialized["finished"],
+                 pairing_trace=serialized.get("pairing_trace"),
+                 pairing_optimal=serialized.get("pairing_optimal", True))
 
 
 def unserialize_tournament(serialized):
-    """Create an instance of a tournament from a dictionary."""
+    """Create an instance of a tournament from a dictionary, or give it from the cache if it was read from the
+    database and didn't change since it was last unserialized."""
+    entry = cache_entry(serialized, db.members_checksum())
+    if entry is not None:
+        tournament = cache.CACHE.get(*entry[:2])
+        if tournament is not None:
+            return tournament
     try:
-        participants = [Member.get_member_from_id(participant) for participant in serialized["participants"]]
+        participants = Member.get_members_from_ids(serialized["participants"])
     except exceptions.NotInDatabaseError:
         raise exceptions.InvalidTournamentError(serialized)
-    players = [unserialize_player(player, participants) for player in serialized["players"]]
+    tournament = unserialize_tournament_with(serialized, participants)
+    if entry is not None:
+        cache.CACHE.put(*entry, tournament)
+    return tournament
+
+
+def cache_entry(serialized, members_checksum):
+    """Return the key, the signature and the size of a tournament in the cache, or None if it can't be cached.
+
+    Only the tournaments read with db.search_tournaments know their shard, hence their key, and the members can only
+    be known unchanged while their index is up to date."""
+    if members_checksum is None or not hasattr(serialized, "shard"):
+        return None
+    content_hash, size = cache.document_hash(serialized)
+    return db.tournament_key(serialized), (content_hash, members_checksum), size
+
+
+def unserialize_tournament_with(serialized, participants):
+    """Create an instance of a tournament from a dictionary and its participants, already unserialized."""
+    players = unserialize_players(serialized["players"], participants)
     return Tournament(name=serialized["name"], place=serialized["place"], date=serialized["date"],
                       max_round=serialized["max_round"], participant_amount=serialized["participant_amount"],
                       tournament_type=serialized["tournament_type"], description=serialized["description"],
                       participants=participants, players=players,
-                      rounds=[unserialize_round(game_round, players) for game_round in serialized["rounds"]],
-                      is_started=serialized["is_started"])
+                      rounds=LazyRounds(serialized["rounds"], players),
+                      is_started=serialized["is_started"], version=serialized.get("version", 0),
+                      system=serialized.get("system", SWISS), schedule=serialized.get("schedule"))
+
+
+def load_tournaments(serialized_tournaments=None, workers=None, skip_invalid=False):
+    """Return tournaments with all their rounds, in the order of serialized_tournaments (by default, all the
+    tournaments of the database, whose shards are read by workers processes).
+
+    The tournaments that didn't change since they were last unserialized are given from the cache, and the others are
+    unserialized by workers processes. A tournament with a member missing from the database raises
+    InvalidTournamentError, or is returned as None if skip_invalid is True."""
+    if serialized_tournaments is None:
+        serialized_tournaments = db.search_tournaments(workers)
+    members_checksum = db.members_checksum()
+    entries = [cache_entry(serialized, members_checksum) for serialized in serialized_tournaments]
+    tournaments = [cache.CACHE.get(*entry[:2]) if entry is not None else None for entry in entries]
+    loaded = iter(unserialize_tournaments([serialized for serialized, tournament
+                                           in zip(serialized_tournaments, tournaments) if tournament is None],
+                                          skip_invalid, workers))
+    for i, entry in enumerate(entries):
+        if tournaments[i] is not None:
+            tournaments[i].rounds.load_all()
+            continue
+        tournaments[i] = next(loaded)
+        if tournaments[i] is not None and entry is not None:
+            cache.CACHE.put(*entry, tournaments[i])
+    return tournaments
+
+
+def unserialize_tournaments(serialized_tournaments, skip_invalid=False, workers=None):
+    """Unserialize tournaments with all their rounds, as load_tournaments, without the cache.
+
+    The members of all the tournaments are read at once, and each one is unserialized once, shared by all the
+    tournaments they played. The tournaments are sent in chunks to the process pool (workers processes, one per core
+    by default), each chunk with the members it references. Sending the tournaments back costs about as much as
+    building them, so with a single worker, or too few tournaments for two chunks, they are built in this process."""
+    identifiants = sorted({i for serialized in serialized_tournaments for i in serialized["participants"]})
+    members = {identifiant: unserialize_member(member)
+               for identifiant, member in zip(identifiants, db.get_members(identifiants)) if member is not None}
+    valid = []
+    for serialized in serialized_tournaments:
+        if all([i in members for i in serialized["participants"]]):
+            valid.append(serialized)
+        elif not skip_invalid:
+            raise exceptions.InvalidTournamentError(serialized)
+    workers = workers or os.cpu_count() or 1
+    # A few chunks by process, so that the processes finishing first get more work.
+    size = max(MIN_CHUNK_SIZE, -(-len(valid) // (workers * 4)))
+    chunks = [valid[start:start + size] for start in range(0, len(valid), size)]
+    if workers == 1 or len(chunks) < 2:
+        built = [unserialize_tournament_with(serialized, [members[i] for i in serialized["participants"]])
+                 for serialized in valid]
+        for tournament in built:
+            tournament.rounds.load_all()
+    else:
+        chunk_members = [{i: members[i].to_dict for serialized in chunk for i in serialized["participants"]}
+                         for chunk in chunks]
+        built = [tournament for chunk in db.get_pool(workers).map(unserialize_chunk, chunks, chunk_members)
+                 for tournament in chunk]
+        # The members built by each process are replaced by those of this process, shared by all the chunks.
+        for serialized, tournament in zip(valid, built):
+            share_members(tournament, [members[i] for i in serialized["participants"]])
+    loaded = iter(built)
+    return [next(loaded) if all([i in members for i in serialized["participants"]]) else None
+            for serialized in serialized_tournaments]
 
 
-def create_pairs(player_list):
-    """Return a dictionary pairing players for a round."""
-    pairs = pairing.first_pairing(player_list)
-    if len(pairs) == len(player_list):
-        return pairs
-    else:
-        return pairing.pairing_fixing(player_list, pairs, (len(player_list) - len(pairs)) // 2)
+def unserialize_chunk(serialized_tournaments, serialized_members):
+    """Unserialize tournaments with all their rounds, serialized_members giving each participant by identifiant.
+
+    It runs in the processes of the pool, and the tournaments are sent back to the main process."""
+    members = {identifiant: Member(**serialized) for identifiant, serialized in serialized_members.items()}
+    tournaments = []
+    for serialized in serialized_tournaments:
+        tournament = unserialize_tournament_with(serialized, [members[i] for i in serialized["participants"]])
+        tournament.rounds.load_all()
+        tournaments.append(tournament)
+    return tournaments
+
+
+def share_members(tournament, participants):
+    """Replace the participants of a tournament (and the members of its players) by the same members, participants."""
+    shared = {id(member): participant for member, participant in zip(tournament.participants, participants)}
+    tournament.participants = participants
+    for player in tournament.players:
+        player.member = shared[id(player.member)]
+
+
+def create_pairs(player_list, time_budget=None, trace=None):
+    """Return a dictionary pairing players for a round, each score group being paired on its own, and whether the
+    pairing is optimal. The phases of the pairing are added to trace if it is given."""
+    return pairing.score_group_pairing(player_list, time_budget=time_budget, trace=trace)
 
 
 def make_pairs_unique(pairs):
-    """Turn a dictionary pairing players into a list that can be used to generate rounds."""
+    """Turn a dictionary pairing players into a list that can be used to generate rounds.
+
+    Each pair is kept in the order it is first found in the dictionary, so that the colours drawn from it only depend
+    on the seed of random, and a recorded session is replayed with the same colours."""
     unique_pairs = []
+    paired = set()
     for key, value in pairs.items():
-        j = {key, value}
-        if j not in unique_pairs:
-            unique_pairs.append(j)
-    unique_pairs = [tuple(element) for element in unique_pairs]
+        if id(key) not in paired:
+            unique_pairs.append((key, value))
+            paired.update([id(key), id(value)])
     return unique_pairs
@@ -1,7 +1,554 @@
 """Implement all operations on the database"""
+import atexit
+import concurrent.futures
+import glob
+import gzip
+import itertools
+import json
+import lzma
+import multiprocessing
+import os
+import re
+import threading
+from collections.abc import Mapping
+
 from tinydb import TinyDB, Query
+from tinydb.storages import JSONStorage
+from tinydb.table import Document, Table
+
+from . import index, snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DATABASE_PATH = "models/db.json"
+
+
+class FileLock:
+    """An exclusive lock shared by all the processes using the same database.
+
+    The lock is reentrant so that a save can hold it while TinyDB takes it again for each read and write."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+        self._owner = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._handle = open(self.path, "a+")
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_LOCK, 1)
+            self._owner = threading.get_ident()
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            self._handle.close()
+            self._handle = None
+            self._owner = None
+        self._thread_lock.release()
+
+    def is_held(self):
+        """Return True if the lock is held by the current thread."""
+        return self._owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+# The ways the database can be compressed, with their module, the bytes starting the files they write and the options
+# of the compression. The default levels compress a few more percent for twice or four times the time of a save (and
+# 100 MB of memory for lzma).
+COMPRESSIONS = {"gzip": (gzip, b"\x1f\x8b", {"compresslevel": 6}),
+                "lzma": (lzma, b"\xfd7zXZ\x00", {"preset": 1})}
+# Returns the saves of a database file that the background writer didn't write yet (see core.TournamentSave), which
+# are read in place of what is written.
+pending_saves = None
+
+
+class LockedJSONStorage(JSONStorage):
+    """A JSON storage that never reads or writes while another process is using the database.
+
+    The indexes of the file (see index.py) are written after each write, and after a read if they don't match it.
+    The file is only created and opened when it is first read or written, so that importing this module (as the
+    processes of the pools do) opens no database."""
+
+    def __init__(self, path, lock=None, **kwargs):
+        self.path = path
+        self.options = kwargs
+        self._handle = None
+        self.lock = lock if lock is not None else FileLock(f"{path}.lock")
+        # The tables of the last content read or written, whose indexes are up to date. TinyDB writes back the
+        # tables it didn't change as the same objects, so their indexes don't have to be written again.
+        self.indexed_tables = {}
+
+    def open_file(self):
+        if self._handle is None:
+            super().__init__(self.path, **self.options)
+
+    def close(self):
+        if self._handle is not None:
+            super().close()
+            self._handle = None
+
+    def read(self):
+        pending = unwritten_saves(self.path, self.lock)
+        with self.lock:
+            self.open_file()
+            data = read_compressed(self.path)
+            if data is None:
+                data = super().read()
+            if data is not None and not index.is_up_to_date(self.path):
+                index.write_indexes(self.path, data)
+            self.indexed_tables = dict(data or {})
+        return with_saves(data, pending) if pending else data
+
+    def write(self, data):
+        with self.lock:
+            self.open_file()
+            previous_mtime_ns = os.stat(self.path).st_mtime_ns
+            self.write_file(data)
+            index.advance_mtime(self.path, previous_mtime_ns)
+            index.write_indexes(self.path, data, [name for name, table in data.items()
+                                                  if self.indexed_tables.get(name) is table])
+            self.indexed_tables = dict(data)
+
+    def write_file(self, data):
+        super().write(data)
+
+
+def unwritten_saves(path, lock):
+    """Return the saves of a database file that aren't written yet, unless this thread holds the lock of the database
+    or of the file: it is then writing, and must read what is written."""
+    if pending_saves is None or LOCK.is_held() or lock.is_held():
+        return []
+    return pending_saves(path)
+
+
+def with_saves(data, pending):
+    """Return the content of a database file with the documents of the pending saves in place of the written ones.
+    The tables changed are copied, since the storage remembers the tables it read."""
+    data = dict(data or {})
+    for pending_save in pending:
+        table = data[pending_save.table] = dict(data.get(pending_save.table, {}))
+        doc_id = next((doc_id for doc_id, serialized in table.items() if matches(serialized, pending_save.fields)),
+                      None)
+        if doc_id is not None:
+            table[doc_id] = pending_save.serialized
+    return data
+
+
+class CompressedJSONStorage(LockedJSONStorage):
+    """A locked storage writing the database compressed, with the compression named in the attribute compression.
+
+    The JSON is compressed while it is written to the file, and decompressed while it is read from it, without
+    keeping the compressed content in memory. Uncompressed files (and files compressed another way) are still read, so
+    a database is converted by its first write."""
+    compression = None
+
+    def write_file(self, data):
+        module, _, options = COMPRESSIONS[self.compression]
+        # The JSON is made at once, as by JSONStorage, since json.dump encodes in Python and is several times slower.
+        # The file is rewritten in place, so that the handle of every storage stays valid.
+        serialized = json.dumps(data, **self.kwargs)
+        with open(self.path, "r+b") as raw_file:
+            with module.open(raw_file, "wt", encoding="utf-8", **options) as text:
+                text.write(serialized)
+            raw_file.truncate()
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+
+class GzipJSONStorage(CompressedJSONStorage):
+    compression = "gzip"
+
+
+class LzmaJSONStorage(CompressedJSONStorage):
+    compression = "lzma"
+
+
+def read_compressed(path):
+    """Return the content of a compressed database file, or None if the file isn't compressed."""
+    with open(path, "rb") as raw_file:
+        start = raw_file.read(max([len(magic) for _, magic, _ in COMPRESSIONS.values()]))
+        for module, magic, _ in COMPRESSIONS.values():
+            if start.startswith(magic):
+                raw_file.seek(0)
+                with module.open(raw_file, "rt", encoding="utf-8") as text:
+                    return json.load(text)
+    return None
+
+
+class SharedTable(Table):
+    """A table that doesn't trust what it remembers of the file, since other processes may have changed it."""
+
+    def _update_table(self, updater):
+        # The file stays locked from the read to the write, so that no other process writes in between.
+        with self._storage.lock:
+            super()._update_table(updater)
+
+    def insert(self, document):
+        if isinstance(document, Document):
+            return super().insert(document)
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents):
+        """Insert documents with the ids following the largest id of the table, found in the content being updated
+        rather than remembered, since other processes may have inserted documents since."""
+        doc_ids = []
+
+        def updater(table):
+            next_id = max(table, default=0) + 1
+            for document in documents:
+                if not isinstance(document, Mapping):
+                    raise ValueError("Document is not a Mapping")
+                doc_ids.append(next_id + len(doc_ids))
+                table[doc_ids[-1]] = dict(document)
+
+        self._update_table(updater)
+        return doc_ids
+
+    def get_multiple(self, doc_ids):
+        """Return the documents with the given doc_ids in a single read, None for the missing ones."""
+        table = self._read_table()
+        return [table.get(self.document_id_class(doc_id)) for doc_id in doc_ids]
+
+    def upsert_fields(self, fields_by_id):
+        """Update the fields of several documents given by doc_id, creating the missing ones, in a single write."""
+        def updater(table):
+            for doc_id, fields in fields_by_id.items():
+                table.setdefault(self.document_id_class(doc_id), {}).update(fields)
+
+        self._update_table(updater)
+
+
+class SharedTinyDB(TinyDB):
+    table_class = SharedTable
+
+
+class Shard:
+    """A database file with its own lock. The main database is the shard named "", and the other shards only hold
+    tournaments."""
+
+    def __init__(self, name, path, storage):
+        self.name = name
+        self.path = path
+        self.lock = FileLock(f"{path}.lock")
+        self.database = SharedTinyDB(path, storage=storage, lock=self.lock)
+        # The query cache is disabled since it would return results that other processes may have made obsolete.
+        self.tournaments = self.database.table("tournaments", cache_size=0)
+
+    def tournament_key(self, doc_id):
+        """Return the identifiant of a tournament of the shard, unique across all the shards."""
+        return f"{self.name}-{doc_id}" if self.name else str(doc_id)
+
+    def documents(self, pairs):
+        """Turn (doc_id, tournament) pairs read from the shard into documents remembering their shard."""
+        documents = []
+        for doc_id, serialized in pairs:
+            document = Document(serialized, doc_id)
+            document.shard = self.name
+            documents.append(document)
+        return documents
+
+
+def use_database(path, storage=LockedJSONStorage):
+    """Make the whole program use the database at path, for example a scratch database."""
+    global DATABASE, LOCK, TOURNAMENT_TABLES, MEMBER_TABLES, HISTORY_TABLES, META_TABLES, MAIN_SHARD, SHARDS, \
+        SHARD_BY, SHARD_BY_SIGNATURE, STORAGE
+    if DATABASE is not None:
+        for shard in SHARDS.values():
+            shard.database.close()
+    STORAGE = storage
+    MAIN_SHARD = Shard("", path, storage)
+    SHARDS = {"": MAIN_SHARD}
+    LOCK = MAIN_SHARD.lock
+    DATABASE = MAIN_SHARD.database
+    TOURNAMENT_TABLES = MAIN_SHARD.tournaments
+    MEMBER_TABLES = DATABASE.table("members", cache_size=0)
+    HISTORY_TABLES = DATABASE.table("history", cache_size=0)
+    META_TABLES = DATABASE.table("meta", cache_size=0)
+    # How the database is split is read when a tournament is first saved or loaded (see shard_of).
+    SHARD_BY = SHARD_BY_SIGNATURE = None
+
+
+def read_meta(key):
+    """Return a value saved in the meta table of the main database, or None."""
+    metas = read_index(MAIN_SHARD, "meta", index.SortedIndex.all)
+    if metas is None:
+        metas = META_TABLES.all()
+    return next((meta[key] for meta in metas if key in meta), None)
+
+
+def read_shard_by():
+    """Return how the database is split, as saved in the main database."""
+    return read_meta("shard_by")
+
+
+def current_shard_by():
+    """Return how the database is split, reading it again only if the meta table changed (another process may have
+    split the database). The table is known unchanged from the checksum of its index."""
+    global SHARD_BY, SHARD_BY_SIGNATURE
+    signature = read_index(MAIN_SHARD, "meta", lambda meta_index: meta_index.records_checksum)
+    if signature is None or signature != SHARD_BY_SIGNATURE:
+        SHARD_BY = read_shard_by()
+        SHARD_BY_SIGNATURE = signature
+    return SHARD_BY
+
+
+def shard_path(name):
+    """Return the path of the file of a shard, next to the main database."""
+    root, extension = os.path.splitext(MAIN_SHARD.path)
+    return f"{root}_{name}{extension}"
+
+
+def get_shard(name):
+    """Return a shard, opening it (and creating its file) the first time it is used."""
+    if name not in SHARDS:
+        SHARDS[name] = Shard(name, shard_path(name), STORAGE)
+    return SHARDS[name]
+
+
+def all_shards():
+    """Return all the shards, including those created by other processes since the database was opened."""
+    root, extension = os.path.splitext(MAIN_SHARD.path)
+    for path in glob.glob(f"{glob.escape(root)}_*{extension}"):
+        get_shard(path[len(root) + 1:len(path) - len(extension)])
+    return [SHARDS[name] for name in sorted(SHARDS)]
+
+
+def shard_name(serialized):
+    """Return the name of the shard a serialized tournament belongs to: the year of its first date if the database
+    is split by season, its place if it is split by club, and "" (the main database) if it isn't split."""
+    if SHARD_BY == SEASON:
+        dates = serialized["date"].split()
+        return dates[0][-4:] if dates else "-"
+    elif SHARD_BY == CLUB:
+        return re.sub(r"[^a-z0-9]+", "-", serialized["place"].lower()).strip("-") or "-"
+    return ""
+
+
+def shard_of(serialized):
+    """Return the shard a serialized tournament must be saved in, checking first if another process split the
+    database differently."""
+    current_shard_by()
+    return get_shard(shard_name(serialized))
+
+
+def tournament_key(document):
+    """Return the identifiant of a tournament read from the database, unique across all the shards."""
+    return get_shard(getattr(document, "shard", "")).tournament_key(document.doc_id)
+
+
+def matches(serialized, criteria):
+    return all(serialized.get(field) == value for field, value in criteria.items())
+
+
+def search_shard(path, storage, criteria):
+    """Return the tournaments of the shard at path whose fields have the values in criteria, as (doc_id, tournament).
+
+    It runs in the processes of the pool, which read the file on their own."""
+    shard_storage = storage(path, lock=FileLock(f"{path}.lock"))
+    try:
+        tournaments = (shard_storage.read() or {}).get("tournaments", {})
+    finally:
+        shard_storage.close()
+    return [(int(doc_id), serialized) for doc_id, serialized in tournaments.items() if matches(serialized, criteria)]
+
+
+def get_pool(workers=None):
+    """Return the process pool, with workers processes (one per core by default). It is created the first time it is
+    used, created again if another number of processes is asked for, and shut down when the program ends.
+
+    Its processes are started with spawn rather than fork, since forking while the background writer holds a lock
+    would give the process a lock that is never released."""
+    global POOL, POOL_WORKERS
+    workers = workers or os.cpu_count() or 1
+    if POOL is not None and workers != POOL_WORKERS:
+        shutdown_pool()
+    if POOL is None:
+        POOL = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT)
+        POOL_WORKERS = workers
+    return POOL
+
+
+def shutdown_pool():
+    """Stop the processes of the pool, if it was created."""
+    global POOL
+    if POOL is not None:
+        POOL.shutdown()
+        POOL = None
+
+
+def search_tournaments(workers=None, **criteria):
+    """Return the tournaments of all the shards whose fields have the given values, or all of them.
+
+    The shards are searched in parallel in a pool of workers processes, except when there is only one shard or one
+    worker, or when the database is locked by this thread (the processes couldn't lock it). Each document knows its
+    shard in its attribute shard."""
+    shards = all_shards()
+    # The pool reads the files directly, without the saves the background writer didn't write yet.
+    if (len(shards) < 2 or workers == 1 or LOCK.is_held()
+            or any([unwritten_saves(shard.path, shard.lock) for shard in shards])):
+        return [document for shard in shards
+                for document in shard.documents([(document.doc_id, document) for document in shard.tournaments.all()
+                                                 if matches(document, criteria)])]
+    results = get_pool(workers).map(search_shard, [shard.path for shard in shards], itertools.repeat(STORAGE),
+                                    itertools.repeat(criteria))
+    return [document for shard, pairs in zip(shards, results) for document in shard.documents(pairs)]
+
+
+def read_index(shard, name, read):
+    """Return what read finds in an index of a shard, or None if the index doesn't match the file anymore, or if the
+    background writer didn't write a save of its table yet, and the table must be read.
+
+    The index is read under index.LOCK, so that it isn't replaced (and closed) meanwhile. The table must be read after
+    releasing it, since a write holds the lock of the file while it replaces the indexes."""
+    if any([pending_save.table == index.TABLES[name] for pending_save in unwritten_saves(shard.path, shard.lock)]):
+        return None
+    with index.LOCK:
+        opened = index.open_index(shard.path, name)
+        return read(opened) if opened is not None else None
+
+
+def index_document(payload):
+    payload = dict(payload)
+    return Document(payload, payload.pop("doc_id"))
+
+
+def members_named(surname, name):
+    """Return the serialized members with a surname and a name, in the order of their doc_id."""
+    doc_ids = read_index(MAIN_SHARD, "member_names",
+                         lambda name_index: name_index.prefix(index.name_key(surname, name, "")))
+    if doc_ids is None:
+        return MEMBER_TABLES.search((QUERY.surname == surname) & (QUERY.name == name))
+    return get_members(sorted(doc_ids))
+
+
+def get_members(doc_ids):
+    """Return the serialized members with the given doc_ids, None for the missing ones."""
+    members = read_index(MAIN_SHARD, "members",
+                         lambda member_index: [member_index.get(index.number_key(doc_id)) for doc_id in doc_ids])
+    if members is None:
+        return MEMBER_TABLES.get_multiple(doc_ids)
+    return [Document(member, doc_id) if member is not None else None for member, doc_id in zip(members, doc_ids)]
+
+
+def member_histories(doc_ids):
+    """Return the documents of the history index of the members with the given doc_ids, {} for those without one."""
+    histories = read_index(MAIN_SHARD, "history", lambda history_index: [history_index.get(index.number_key(doc_id))
+                                                                         for doc_id in doc_ids])
+    if histories is None:
+        histories = HISTORY_TABLES.get_multiple(doc_ids)
+    return [history or {} for history in histories]
+
+
+def update_tables(shard, updaters):
+    """Change several tables of a shard with a single read and a single write of its file. updaters is a list of
+    (table name, function changing the documents of the table, given as a dictionary by doc_id)."""
+    with shard.lock:
+        data = shard.database.storage.read() or {}
+        for name, updater in updaters:
+            table = {int(doc_id): document for doc_id, document in data.get(name, {}).items()}
+            updater(table)
+            data[name] = {str(doc_id): document for doc_id, document in table.items()}
+        shard.database.storage.write(data)
+
+
+def members_checksum():
+    """Return a checksum that only changes when a member changes, or None if the index of the members doesn't match
+    the database."""
+    return read_index(MAIN_SHARD, "members", lambda member_index: member_index.records_checksum)
+
+
+def tournament_headers():
+    """Return the name, place, date, type and description of all the tournaments of all the shards, in the order of
+    search_tournaments, without reading the shards whose index is up to date."""
+    headers = []
+    for shard in all_shards():
+        payloads = read_index(shard, "tournaments", index.SortedIndex.all)
+        if payloads is None:
+            pairs = [(document.doc_id, document) for document in shard.tournaments.all()]
+        else:
+            pairs = sorted([(header.doc_id, header) for header in map(index_document, payloads)],
+                           key=lambda pair: pair[0])
+        headers.extend(shard.documents(pairs))
+    return headers
+
+
+def reshard(mode):
+    """Split the database with a new mode (SEASON, CLUB or None), moving every tournament to its new shard.
+
+    Return the number of tournaments moved. The history index is keyed by tournament, so it must be rebuilt. The
+    snapshots of the tournaments moved are published again under their new key."""
+    global SHARD_BY, SHARD_BY_SIGNATURE
+    with LOCK:
+        tournaments = search_tournaments()
+        META_TABLES.upsert({"shard_by": mode}, Query().shard_by.exists())
+        SHARD_BY = mode
+        SHARD_BY_SIGNATURE = None
+        moved = [serialized for serialized in tournaments if shard_name(serialized) != serialized.shard]
+        # Each shard is written once for all the tournaments it receives and once for all those it loses.
+        arrivals = {}
+        departures = {}
+        for serialized in moved:
+            arrivals.setdefault(shard_name(serialized), []).append(serialized)
+            departures.setdefault(serialized.shard, []).append(serialized.doc_id)
+        # The new documents get ids above those of the shard, so a new key is never the old key of a moved tournament.
+        new_keys = {}
+        for name, new_tournaments in arrivals.items():
+            with get_shard(name).lock:
+                doc_ids = get_shard(name).tournaments.insert_multiple([dict(document) for document in new_tournaments])
+            for serialized, doc_id in zip(new_tournaments, doc_ids):
+                new_keys[tournament_key(serialized)] = get_shard(name).tournament_key(doc_id)
+        for name, doc_ids in departures.items():
+            with get_shard(name).lock:
+                get_shard(name).tournaments.remove(doc_ids=doc_ids)
+        for old_key, new_key in new_keys.items():
+            snapshot.move_snapshot(old_key, new_key)
+        for shard in all_shards():
+            if shard.name and len(shard.tournaments) == 0:
+                shard.database.close()
+                os.remove(shard.path)
+                index.remove_indexes(shard.path)
+                # Nothing uses the shard anymore (the database is locked), so its lock goes with it.
+                try:
+                    os.remove(shard.lock.path)
+                except FileNotFoundError:
+                    pass
+                del SHARDS[shard.name]
+    return len(moved)
+
 
-DATABASE = TinyDB("models/db.json")
-TOURNAMENT_TABLES = DATABASE.table("tournaments")
-MEMBER_TABLES = DATABASE.table("members")
+# The storage writing the database with each compression.
+COMPRESSED_STORAGES = {"gzip": GzipJSONStorage, "lzma": LzmaJSONStorage}
+SEASON = "season"
+CLUB = "club"
+POOL = None
+POOL_WORKERS = None
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+DATABASE = None
+use_database(DATABASE_PATH)
+atexit.register(shutdown_pool)
 QUERY = Query()
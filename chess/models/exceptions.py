@@ -79,3 +79,24 @@ class AlreadyFinishedError(Exception):
 class TournamentNotStartedError(Exception):
     """Raised when trying to create a round when the tournament hasn't started yet."""
     pass
+
+
+class ConflictError(Exception):
+    """Raised when a tournament was changed by another process in a way that can't be merged."""
+    pass
+
+
+class InvalidRoundAmountError(Exception):
+    """Raised when the number of rounds of a round robin doesn't match its number of participants."""
+    pass
+
+
+class InvalidTRFError(Exception):
+    """Raised when a line of a TRF file can't be read."""
+    def __init__(self, line_number):
+        self.line_number = line_number
+
+
+class TournamentAlreadyExistsError(Exception):
+    """Raised when importing a tournament that is already in the database."""
+    pass
@@ -0,0 +1,251 @@
+"""Exchange tournaments with the federation systems, as FIDE TRF files and PGN games.
+
+The exports are written round by round. The TRF line of each player is first written with empty round columns, then
+the results of each round are written at their place in the file, so only one round is in memory at a time. TRF files
+are imported line by line, and the missing members and the tournament with all its rounds are created in a few
+writes, without going through the controllers."""
+import os
+from datetime import datetime
+
+from . import core, db, exceptions
+from .translate import TRANSLATION
+
+GENDERS = TRANSLATION["trf_genders"]
+DEFAULT_DIRECTORY = "exports"
+# Each round of a player takes 10 columns in a TRF line: the number of the opponent, the colour and the result.
+ROUND_WIDTH = 10
+PLAYER_COLUMNS = 89
+# The TRF result of the white player and of the black player for each score, and the score for each result of white.
+TRF_RESULTS = {"1-0": ("1", "0"), "0-1": ("0", "1"), "1/2-1/2": ("=", "=")}
+SCORES = {"1": "1-0", "+": "1-0", "W": "1-0", "0": "0-1", "-": "0-1", "L": "0-1", "=": "1/2-1/2", "D": "1/2-1/2"}
+HEADER_CODES = {"012": "name", "022": "place", "042": "start", "052": "end", "092": "type", "XXR": "max_round"}
+# TRF files don't give the times of the rounds, and often don't give the birthdates.
+UNKNOWN_TIME = "00:00"
+UNKNOWN_BIRTHDATE = "01/01/1900"
+
+
+def trf_date(date_text):
+    """Turn a date from dd/mm/yyyy to yyyy/mm/dd, or back."""
+    return "/".join(reversed(date_text.replace("-", "/").replace(".", "/").split("/")))
+
+
+def trf_name(member):
+    return f"{member.surname}, {member.name}"
+
+
+def pgn_tag(name, value):
+    """Return a PGN tag, escaping the characters that can't appear in its value."""
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'[{name} "{value}"]\n'
+
+
+def trf_header(tournament):
+    """Yield the lines describing the tournament at the start of a TRF file."""
+    dates = tournament.date_text.split()
+    yield f"012 {tournament.name}"
+    yield f"022 {tournament.place}"
+    yield f"042 {trf_date(dates[0])}"
+    yield f"052 {trf_date(dates[-1])}"
+    yield f"062 {len(tournament.players)}"
+    yield f"092 {tournament.type}"
+    yield f"XXR {tournament.max_round}"
+
+
+def player_line(number, player, rank):
+    """Return the TRF line of a player, without the rounds."""
+    member = player.member
+    gender = next((code for code, name in GENDERS.items() if name.lower() == member.gender.lower()), " ")
+    return (f"001 {number:>4} {gender}    {trf_name(member)[:33]:<33} {member.ranking:>4} {'':>3} {'':>11} "
+            f"{trf_date(member.birthdate_text):<10} {player.points:>4.1f} {rank:>4}")
+
+
+def export_trf(tournament, path):
+    """Write a started tournament in a TRF file, one round at a time."""
+    numbers = {id(player): number for number, player in enumerate(tournament.players, 1)}
+    ranks = {id(player): rank for rank, player in enumerate(tournament.result, 1)}
+    empty_rounds = " " * ROUND_WIDTH * len(tournament.rounds)
+    positions = {}
+    # The file is written as bytes, since the round columns are written at positions given in bytes.
+    with open(path, "wb") as trf_file:
+        for line in trf_header(tournament):
+            trf_file.write(f"{line}\n".encode("utf-8"))
+        for player in tournament.players:
+            trf_file.write(player_line(numbers[id(player)], player, ranks[id(player)]).encode("utf-8"))
+            positions[id(player)] = trf_file.tell()
+            trf_file.write(f"{empty_rounds}\n".encode("utf-8"))
+        for round_index, game_round in enumerate(tournament.rounds.stream()):
+            for game in game_round.games:
+                if game.score not in TRF_RESULTS:
+                    continue
+                white_result, black_result = TRF_RESULTS[game.score]
+                for player, opponent, color, result in ((game.white_player, game.black_player, "w", white_result),
+                                                        (game.black_player, game.white_player, "b", black_result)):
+                    trf_file.seek(positions[id(player)] + ROUND_WIDTH * round_index)
+                    trf_file.write(f"  {numbers[id(opponent)]:>4} {color} {result}".encode("utf-8"))
+
+
+def pgn_games(tournament):
+    """Yield the PGN of each game, round by round. Only the headers are known, so the result is the only move."""
+    date = trf_date(tournament.date_text.split()[0]).replace("/", ".")
+    for game_round in tournament.rounds.stream():
+        for game in game_round.games:
+            result = game.score if game.score in TRF_RESULTS else "*"
+            yield (pgn_tag("Event", tournament.name) + pgn_tag("Site", tournament.place) + pgn_tag("Date", date)
+                   + pgn_tag("Round", game_round.number) + pgn_tag("White", trf_name(game.white_player.member))
+                   + pgn_tag("Black", trf_name(game.black_player.member)) + pgn_tag("Result", result)
+                   + f"\n{result}\n\n")
+
+
+def export_pgn(tournament, path):
+    """Write the games of a tournament in a PGN file, one game at a time."""
+    with open(path, "w", encoding="utf-8") as pgn_file:
+        for game in pgn_games(tournament):
+            pgn_file.write(game)
+
+
+def export(tournament, directory=DEFAULT_DIRECTORY):
+    """Write the TRF and the PGN files of a started tournament in directory. Return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    base_name = os.path.join(directory, f"{tournament.name}_{trf_date(tournament.date_text.split()[0])}"
+                             .replace("/", "-"))
+    export_trf(tournament, f"{base_name}.trf")
+    export_pgn(tournament, f"{base_name}.pgn")
+    return f"{base_name}.trf", f"{base_name}.pgn"
+
+
+def parse_birthdate(text):
+    """Return a TRF birthdate as dd/mm/yyyy. Some files only give the year, or nothing."""
+    if not text:
+        return UNKNOWN_BIRTHDATE
+    if text.isdigit():
+        return f"01/01/{text}"
+    birthdate = trf_date(text)
+    datetime.strptime(birthdate, "%d/%m/%Y")
+    return birthdate
+
+
+def parse_player(line):
+    """Return the number, the serialized member, the points and the rounds of a TRF player line.
+
+    Each round is given as the number of the opponent (None if there was no opponent), the colour and the result."""
+    surname, _, name = line[14:47].partition(",")
+    member = {"surname": surname.strip().upper(),
+              "name": name.strip().capitalize(),
+              "birthdate": parse_birthdate(line[69:79].strip()),
+              "gender": GENDERS.get(line[9].lower(), ""),
+              "ranking": int(line[48:52].strip() or 0),
+              "discriminator": 0}
+    rounds = []
+    for start in range(PLAYER_COLUMNS, len(line), ROUND_WIDTH):
+        block = line[start:start + ROUND_WIDTH].ljust(ROUND_WIDTH)
+        opponent = int(block[2:6].strip() or 0)
+        rounds.append((opponent or None, block[7], block[9]))
+    return int(line[4:8]), member, float(line[80:84]), rounds
+
+
+def read_trf(path):
+    """Return the header of a TRF file and its players, as (line number, number, member, points, rounds)."""
+    header = {}
+    players = []
+    with open(path, encoding="utf-8") as trf_file:
+        for line_number, line in enumerate(trf_file, 1):
+            line = line.rstrip("\r\n")
+            code = line[:3]
+            try:
+                if code == "001":
+                    players.append((line_number, *parse_player(line)))
+                elif code in HEADER_CODES:
+                    header[HEADER_CODES[code]] = line[4:].strip()
+                    if code in ("042", "052"):
+                        datetime.strptime(trf_date(header[HEADER_CODES[code]]), "%d/%m/%Y")
+            except (ValueError, IndexError):
+                raise exceptions.InvalidTRFError(line_number)
+    if "name" not in header or "start" not in header:
+        raise exceptions.InvalidTRFError(None)
+    return header, players
+
+
+def find_or_create_members(members):
+    """Return the doc_id of each serialized member with the members as they are saved, and the number created.
+
+    A member is already in the database if they have the same surname, name and birthdate. The members are looked up
+    by name in the index, so only the homonyms of the imported members are read. The others are created in a single
+    write, with a discriminator if a member has the same name."""
+    known = {}
+    homonyms = {}
+    new_members = []
+    for member in members:
+        key = (member["surname"], member["name"], member["birthdate"])
+        if key[:2] not in homonyms:
+            named = db.members_named(*key[:2])
+            homonyms[key[:2]] = len(named)
+            for serialized in named:
+                known.setdefault((serialized["surname"], serialized["name"], serialized["birthdate"]),
+                                 (serialized.doc_id, serialized))
+        if key not in known:
+            member["discriminator"] = homonyms[key[:2]]
+            homonyms[key[:2]] += 1
+            known[key] = (None, member)
+            new_members.append(member)
+    new_ids = iter(db.MEMBER_TABLES.insert_multiple(new_members))
+    for key, (doc_id, member) in known.items():
+        if doc_id is None:
+            known[key] = (next(new_ids), member)
+    found = [known[member["surname"], member["name"], member["birthdate"]] for member in members]
+    return [doc_id for doc_id, _ in found], [member for _, member in found], len(new_members)
+
+
+def import_trf(path):
+    """Create a finished tournament and its missing members from a TRF file.
+
+    Return the serialized tournament and the number of members created."""
+    header, players = read_trf(path)
+    if len(players) % 2 != 0:
+        raise exceptions.OddParticipantError
+    indexes = {number: i for i, (_, number, _, _, _) in enumerate(players)}
+    round_amount = max([len(rounds) for *_, rounds in players], default=0)
+    serialized_rounds = [{"round_number": i + 1, "starting_time": UNKNOWN_TIME, "ending_time": UNKNOWN_TIME,
+                          "finished": True, "games": []} for i in range(round_amount)]
+    serialized_players = []
+    for i, (line_number, _, _, points, rounds) in enumerate(players):
+        opponents = []
+        for round_index, (opponent, color, result) in enumerate(rounds):
+            if opponent is None or result not in SCORES:
+                continue
+            if opponent not in indexes:
+                raise exceptions.InvalidTRFError(line_number)
+            opponents.append(indexes[opponent])
+            # Each game is on the lines of both players, it is only taken from the line of the white player.
+            if color == "w":
+                serialized_rounds[round_index]["games"].append({"white_player_index": i,
+                                                                "black_player_index": indexes[opponent],
+                                                                "score": SCORES[result]})
+        serialized_players.append({"member_index": i, "opponents": opponents, "points": points})
+    dates = [trf_date(header["start"])]
+    if header.get("end") and trf_date(header["end"]) != dates[0]:
+        dates.append(trf_date(header["end"]))
+    serialized = {"name": header["name"].capitalize(),
+                  "place": header.get("place", ""),
+                  "date": " ".join(dates),
+                  "max_round": int(header.get("max_round") or round_amount),
+                  "tournament_type": header.get("type", "").capitalize(),
+                  "description": "",
+                  "participant_amount": len(players),
+                  "rounds": serialized_rounds,
+                  "players": serialized_players,
+                  "is_started": True,
+                  "version": 1,
+                  "system": core.SWISS,
+                  "schedule": None,
+                  "schema": core.SCHEMA_VERSION}
+    query = ((db.QUERY.name == serialized["name"]) & (db.QUERY.place == serialized["place"]) &
+             (db.QUERY.date == serialized["date"]))
+    with db.LOCK:
+        shard = db.shard_of(serialized)
+        if shard.tournaments.contains(query):
+            raise exceptions.TournamentAlreadyExistsError
+        serialized["participants"], serialized_members, created = find_or_create_members(
+            [member for _, _, member, _, _ in players])
+        with shard.lock:
+            core.write_tournament(shard, serialized, serialized_members)
+    return serialized, created
@@ -0,0 +1,46 @@
+"""Read the results written in a file, or in the files of a directory, while another program writes them.
+
+The electronic boards and the scorers' desk append a line to a results file for each game. The feed remembers how far
+each file was read, so each call only reads what was appended since, and keeps an incomplete last line until it is
+finished. A file that got shorter was replaced, and is read again from the start."""
+import os
+
+# The time between two reads of the files, and the longest time results wait before being saved, in seconds.
+POLL_INTERVAL = 0.5
+SAVE_INTERVAL = 2
+
+
+class ResultsFeed:
+    """The lines appended to a file, or to the files of a directory, since the last read."""
+
+    def __init__(self, path):
+        self.path = path
+        # The position read and the incomplete last line of each file, by path.
+        self.positions = {}
+        self.partial_lines = {}
+
+    def paths(self):
+        """Return the files to read, in the order of their names for a directory, including the new ones."""
+        if not os.path.isdir(self.path):
+            return [self.path]
+        return sorted([os.path.join(self.path, name) for name in os.listdir(self.path)
+                       if os.path.isfile(os.path.join(self.path, name))])
+
+    def read_lines(self):
+        """Return the complete lines appended to the files since the last call."""
+        lines = []
+        for path in self.paths():
+            try:
+                with open(path, "rb") as results_file:
+                    size = os.fstat(results_file.fileno()).st_size
+                    if size < self.positions.get(path, 0):
+                        self.positions[path] = 0
+                        self.partial_lines[path] = b""
+                    results_file.seek(self.positions.get(path, 0))
+                    appended = results_file.read()
+            except OSError:
+                continue
+            self.positions[path] = self.positions.get(path, 0) + len(appended)
+            *complete, self.partial_lines[path] = (self.partial_lines.get(path, b"") + appended).split(b"\n")
+            lines.extend([line.decode("utf-8", errors="replace").strip() for line in complete])
+        return [line for line in lines if line]
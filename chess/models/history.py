@@ -0,0 +1,128 @@
+"""Maintain an index of the games played by each member across all tournaments.
+
+The index has one document per member, with the same doc_id as the member. It maps the identifiant of each
+tournament the member played to their points and games in it, so that the history of a member is read without
+unserializing any tournament. It is read through its index file (see index.py), without parsing the database, and a
+save only writes the entries of the members whose results changed, in the same write as the tournament when the
+tournament is in the main database."""
+from . import db
+
+POINTS = {"1-0": (1.0, 0.0), "0-1": (0.0, 1.0), "1/2-1/2": (0.5, 0.5)}
+
+
+def display_name(serialized_member):
+    """Return the name of a member as displayed for players."""
+    if serialized_member["discriminator"] != 0:
+        return f"{serialized_member['surname']} {serialized_member['name']} {serialized_member['discriminator']}"
+    else:
+        return f"{serialized_member['surname']} {serialized_member['name']}"
+
+
+def tournament_entries(serialized, serialized_members):
+    """Return the entry of each participant of a serialized tournament, indexed by their member doc_id.
+
+    serialized_members must be the serialized participants, in the same order as in the tournament."""
+    participants = serialized["participants"]
+    member_indexes = [player["member_index"] for player in serialized["players"]]
+    entries = {participants[member_index]: {"name": serialized["name"],
+                                            "date": serialized["date"],
+                                            "points": player["points"],
+                                            "games": []}
+               for member_index, player in zip(member_indexes, serialized["players"])}
+    for serialized_round in serialized["rounds"]:
+        for game in serialized_round["games"]:
+            if game["score"] not in POINTS:
+                continue
+            white = member_indexes[game["white_player_index"]]
+            black = member_indexes[game["black_player_index"]]
+            white_points, black_points = POINTS[game["score"]]
+            for own, opponent, color, points in ((white, black, "white", white_points),
+                                                 (black, white, "black", black_points)):
+                played = {"round": serialized_round["round_number"],
+                          "opponent": participants[opponent],
+                          "opponent_name": display_name(serialized_members[opponent]),
+                          "color": color,
+                          "score": game["score"],
+                          "points": points}
+                entries[participants[own]]["games"].append(played)
+    return entries
+
+
+def changed_entries(tournament_key, entries):
+    """Return the entries of tournament_entries that aren't in the index yet, or differ from it, by member doc_id, so
+    that only the members whose results changed are written. tournament_key is None for a tournament that isn't in
+    the database yet, whose entries are all new."""
+    if tournament_key is None:
+        return entries
+    histories = db.member_histories(list(entries))
+    return {member_id: entry for (member_id, entry), indexed in zip(entries.items(), histories)
+            if indexed.get(tournament_key) != entry}
+
+
+def entries_updater(tournament_key, entries):
+    """Return the function adding entries by member doc_id to the history table, for db.update_tables.
+
+    tournament_key can be a function returning it, for a tournament whose doc_id is found in the same write."""
+    def updater(table):
+        key = tournament_key() if callable(tournament_key) else tournament_key
+        for member_id, entry in entries.items():
+            table[member_id] = dict(table.get(member_id, {}), **{key: entry})
+    return updater
+
+
+def mark_built_if_complete():
+    """When the first tournament of a database is indexed, the index holds all its tournaments."""
+    if not is_built() and len(db.tournament_headers()) <= 1:
+        mark_built()
+
+
+def rebuild():
+    """Build the whole index again from all the tournaments in the database, in a single write. The members are read
+    from their index."""
+    with db.LOCK:
+        tournaments = db.search_tournaments()
+        identifiants = sorted({i for serialized in tournaments for i in serialized["participants"]})
+        members = {identifiant: member for identifiant, member in zip(identifiants, db.get_members(identifiants))
+                   if member is not None}
+        history = {}
+        for serialized in tournaments:
+            try:
+                serialized_members = [members[participant] for participant in serialized["participants"]]
+            except KeyError:
+                continue
+            for member_id, entry in tournament_entries(serialized, serialized_members).items():
+                history.setdefault(member_id, {})[db.tournament_key(serialized)] = entry
+
+        def replace(table):
+            table.clear()
+            table.update(history)
+
+        db.update_tables(db.MAIN_SHARD, [("history", replace)])
+        mark_built()
+
+
+def mark_built():
+    db.META_TABLES.upsert({"history_built": True}, db.QUERY.history_built.exists())
+
+
+def is_built():
+    """Return True if the index holds all the tournaments of the database."""
+    return bool(db.read_meta("history_built"))
+
+
+def ensure_built():
+    """Build the index if it has never been built, for databases created before it existed."""
+    if not is_built():
+        rebuild()
+
+
+def member_history(member_id):
+    """Return the entries of a member, indexed by tournament identifiant, in the order they were played."""
+    ensure_built()
+    return db.member_histories([member_id])[0]
+
+
+def head_to_head(member_id, opponent_id):
+    """Return the games a member played against another one, with the name of the tournament they were played in."""
+    return [(entry["name"], game) for entry in member_history(member_id).values()
+            for game in entry["games"] if game["opponent"] == opponent_id]
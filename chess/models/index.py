@@ -0,0 +1,290 @@
+"""Maintain sorted index files next to the database files, read with mmap and binary searched.
+
+Each time a database file is written, an index is written next to it for the members by identifiant, the members by
+name, the headers of the tournaments, the meta table and the history of the members. An index starts with the size
+and the modification time of the database file it was built from, so it is only used while it matches that file, then
+a checksum of its records, which only changes with the content of its table. Looking a key up only reads the pages of
+the index touched by the binary search, instead of parsing the whole database. The indexes of the tables that a write
+didn't change are copied with the signature of the new file.
+
+Checking a checksum of the database file would mean reading it whole before each lookup, so each write makes the
+modification time of the file later than before instead (see advance_mtime): every version of the file written by the
+program has its own signature.
+
+An index is never changed in place: a new file replaces it. Its map is closed first, under LOCK, since Windows can't
+replace or remove a file that is mapped, so the indexes must be read under LOCK too.
+
+Index layout: a header, then the offset of each record (in the order of the keys), then the records. Each record is
+the length and the bytes of its key, then the length and the bytes of its JSON payload."""
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+MAGIC = b"CHIX"
+VERSION = 3
+HEADER = struct.Struct("<4sIQqII")
+OFFSET = struct.Struct("<Q")
+LENGTH = struct.Struct("<I")
+SEPARATOR = "\x1f"
+# The table each index is built from, by name of index.
+TABLES = {"members": "members", "member_names": "members", "tournaments": "tournaments", "meta": "meta",
+          "history": "history"}
+NAMES = tuple(TABLES)
+# The fields of the tournaments kept in their index.
+HEADER_FIELDS = ("name", "place", "date", "tournament_type", "description")
+# The opened indexes, by path.
+OPENED = {}
+# The records last written in each index by this process, by path, then by doc_id, with what they were made from.
+BUILT = {}
+# Held while an opened index is read, and while an index is replaced or removed.
+LOCK = threading.RLock()
+
+
+def index_path(database_path, name):
+    return f"{database_path}.{name}.idx"
+
+
+def number_key(number):
+    """Return a key that sorts numbers in their order."""
+    return f"{int(number):010d}"
+
+
+def name_key(*parts):
+    return SEPARATOR.join([str(part) for part in parts])
+
+
+def record_source(name, document):
+    """Return what the record of a document in an index is made from, to know if it changed. The members and the meta
+    are flat, and the entries of a history are replaced rather than changed, so a shallow copy is enough."""
+    if name == "member_names":
+        return document["surname"], document["name"], document["discriminator"]
+    elif name == "tournaments":
+        return tuple([document[field] for field in HEADER_FIELDS])
+    return dict(document)
+
+
+def index_record(name, doc_id, document):
+    """Return the key and the payload (as JSON) of the record of a document in an index.
+
+    The index of the names only gives the doc_id of each member, to be found in the index of the members."""
+    if name == "member_names":
+        return name_key(document["surname"], document["name"], number_key(document["discriminator"])), str(doc_id)
+    elif name == "tournaments":
+        header = {"doc_id": int(doc_id), **{field: document[field] for field in HEADER_FIELDS}}
+        return name_key(document["name"], number_key(doc_id)), json.dumps(header)
+    return number_key(doc_id), json.dumps(document)
+
+
+def index_blobs(path, name, table):
+    """Return the encoded key and record of each document of a table in the index at path, in the order of the keys.
+
+    Encoding a large table is most of the time of a write, so the records of the documents that didn't change since
+    this process last wrote the index are kept in BUILT and reused."""
+    previous = BUILT.get(path, {})
+    built = {}
+    for doc_id, document in table.items():
+        source = record_source(name, document)
+        kept = previous.get(doc_id)
+        if kept is None or kept[0] != source:
+            key, payload = [part.encode("utf-8") for part in index_record(name, doc_id, document)]
+            kept = (source, key, LENGTH.pack(len(key)) + key + LENGTH.pack(len(payload)) + payload)
+        built[doc_id] = kept
+    BUILT[path] = built
+    return sorted([(key, blob) for _, key, blob in built.values()], key=lambda record: record[0])
+
+
+def write_index(path, blobs, signature):
+    """Write an index from the blobs given by index_blobs atomically, so that readers see either the old one or the
+    new one."""
+    records = b"".join([blob for _, blob in blobs])
+    offsets = bytearray()
+    offset = HEADER.size + OFFSET.size * len(blobs)
+    for _, blob in blobs:
+        offsets += OFFSET.pack(offset)
+        offset += len(blob)
+    with open(f"{path}.tmp", "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, VERSION, *signature, zlib.crc32(records), len(blobs)))
+        index_file.write(offsets)
+        index_file.write(records)
+    replace_index(path)
+
+
+def sign_index(path, signature):
+    """Make an index match a new version of its database file whose table didn't change, copying it with the new
+    signature. Return False if the index couldn't be read."""
+    try:
+        with open(path, "rb") as index_file:
+            content = index_file.read()
+        magic, version, *header = HEADER.unpack_from(content)
+    except (OSError, struct.error):
+        return False
+    if magic != MAGIC or version != VERSION:
+        return False
+    with open(f"{path}.tmp", "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, VERSION, *signature, *header[-2:]))
+        index_file.write(memoryview(content)[HEADER.size:])
+    replace_index(path)
+    return True
+
+
+def close_index(path):
+    """Close the map of an index, if it is opened. LOCK must be held."""
+    opened = OPENED.pop(path, None)
+    if opened is not None:
+        opened.map.close()
+
+
+def replace_index(path):
+    """Replace an index by the new one written next to it.
+
+    On Windows, another process reading the index prevents it from being replaced: the old index is kept, and isn't
+    used anymore since it doesn't match the database file."""
+    with LOCK:
+        close_index(path)
+        try:
+            os.replace(f"{path}.tmp", path)
+        except PermissionError:
+            os.remove(f"{path}.tmp")
+
+
+def remove_indexes(database_path):
+    """Remove the indexes of a database file."""
+    with LOCK:
+        for name in NAMES:
+            close_index(index_path(database_path, name))
+            BUILT.pop(index_path(database_path, name), None)
+            if os.path.exists(index_path(database_path, name)):
+                os.remove(index_path(database_path, name))
+
+
+def advance_mtime(database_path, previous_mtime_ns):
+    """Make the modification time of a database file just written later than previous_mtime_ns, its time before the
+    write. The clock of the file system is coarser than a write (a few milliseconds on Linux), so two writes of the
+    same size, such as two results changed, could leave the same signature, and an index of the first one that
+    couldn't be replaced would still match. The step is a microsecond, as NTFS keeps tenths of microseconds."""
+    stat = os.stat(database_path)
+    if stat.st_mtime_ns <= previous_mtime_ns:
+        os.utime(database_path, ns=(stat.st_atime_ns, previous_mtime_ns + 1000))
+
+
+def write_indexes(database_path, data, unchanged_tables=()):
+    """Write the indexes of a database file from its content, just after it was written.
+
+    The indexes built from unchanged_tables only get the signature of the new file."""
+    stat = os.stat(database_path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    unchanged = [name for name, table in TABLES.items()
+                 if table in unchanged_tables and sign_index(index_path(database_path, name), signature)]
+    for name in NAMES:
+        if name not in unchanged:
+            path = index_path(database_path, name)
+            write_index(path, index_blobs(path, name, data.get(TABLES[name], {})), signature)
+
+
+def read_header(path):
+    """Return the size and the modification time of the database file an index was built from, with the checksum and
+    the number of its records, or None if the index is missing or isn't an index."""
+    try:
+        with open(path, "rb") as index_file:
+            magic, version, *header = HEADER.unpack(index_file.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return header if magic == MAGIC and version == VERSION else None
+
+
+def matches(header, database_path):
+    """Return True if an index was built from the current content of the database file, from its size and its
+    modification time. A database file copied with another time is indexed again by its next read."""
+    size, mtime_ns, *_ = header
+    try:
+        stat = os.stat(database_path)
+    except FileNotFoundError:
+        return False
+    return (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+
+
+class SortedIndex:
+    """An index file opened with mmap."""
+
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self.stat = os.fstat(index_file.fileno())
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *self.header = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path)
+        self.records_checksum, self.count = self.header[-2:]
+
+    def record_offset(self, position):
+        return OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * position)[0]
+
+    def key(self, position):
+        offset = self.record_offset(position)
+        length = LENGTH.unpack_from(self.map, offset)[0]
+        return self.map[offset + LENGTH.size:offset + LENGTH.size + length]
+
+    def payload(self, position):
+        offset = self.record_offset(position)
+        offset += LENGTH.size + LENGTH.unpack_from(self.map, offset)[0]
+        length = LENGTH.unpack_from(self.map, offset)[0]
+        return json.loads(self.map[offset + LENGTH.size:offset + LENGTH.size + length])
+
+    def lower_bound(self, key):
+        """Return the position of the first key greater than or equal to key."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, key):
+        """Return the payload of a key, or None."""
+        key = key.encode("utf-8")
+        position = self.lower_bound(key)
+        if position < self.count and self.key(position) == key:
+            return self.payload(position)
+        return None
+
+    def prefix(self, prefix):
+        """Return the payloads of all the keys starting with prefix, in the order of the keys."""
+        prefix = prefix.encode("utf-8")
+        payloads = []
+        position = self.lower_bound(prefix)
+        while position < self.count and self.key(position).startswith(prefix):
+            payloads.append(self.payload(position))
+            position += 1
+        return payloads
+
+    def all(self):
+        return [self.payload(position) for position in range(self.count)]
+
+
+def open_index(database_path, name):
+    """Return an index of a database file, or None if it doesn't exist or doesn't match the file anymore. LOCK must be
+    held while the index is read."""
+    path = index_path(database_path, name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    opened = OPENED.get(path)
+    # The index may have been replaced by another process, whose new file is opened again.
+    if opened is None or (opened.stat.st_ino, opened.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        close_index(path)
+        try:
+            opened = OPENED[path] = SortedIndex(path)
+        except (ValueError, struct.error, OSError):
+            return None
+    return opened if matches(opened.header, database_path) else None
+
+
+def is_up_to_date(database_path):
+    """Return True if all the indexes of a database file match it, only reading their headers."""
+    headers = [read_header(index_path(database_path, name)) for name in NAMES]
+    return all([header is not None and matches(header, database_path) for header in headers])
@@ -1,5 +1,60 @@
-"""Has several functions to pair players with the goal of following the swiss rounds rules."""
+"""Has several functions to pair players with the goal of following the swiss rounds rules.
+
+The pairing functions take an optional trace, a list to which each phase of the pairing appends a dictionary with its
+name, its duration in seconds and what it did (candidates enumerated, depth of the depairing, reason of a fallback),
+so that a slow or surprising pairing can be understood after the fact."""
+import concurrent.futures
+import heapq
 import itertools
+import math
+import multiprocessing
+import time
+from contextlib import contextmanager
+
+# Under this amount of players, the score groups are paired one after the other since starting processes would cost
+# more than the pairing itself.
+PARALLEL_MINIMUM = 200
+# The most combinations of games pairing_fixing enumerates at once. Past that, enumerating takes seconds and gigabytes,
+# so the pairing without rematches found by rematch_free_pairing is taken instead.
+MAX_COMBINATIONS = 200000
+
+
+@contextmanager
+def traced(trace, phase, **details):
+    """Add a phase to trace (if it isn't None) with details, which the phase can complete, and its duration."""
+    entry = dict(phase=phase, **details)
+    if trace is not None:
+        trace.append(entry)
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["seconds"] = round(time.perf_counter() - start, 6)
+
+
+def summarize(trace):
+    """Return one entry by phase of trace, in the order of their first run, with the number of runs, their total
+    duration, the candidates and branches they went through, whether they were all optimal and the reason of the last
+    fallback. A summary can be summarized again."""
+    summary = {}
+    for entry in trace:
+        phase = summary.setdefault(entry["phase"], {"phase": entry["phase"], "runs": 0, "seconds": 0})
+        phase["runs"] += entry.get("runs", 1)
+        phase["seconds"] = round(phase["seconds"] + entry["seconds"], 6)
+        for key in ("candidates", "nodes"):
+            if key in entry:
+                phase[key] = phase.get(key, 0) + entry[key]
+        if "reason" in entry:
+            phase["reason"] = entry["reason"]
+        if "optimal" in entry:
+            phase["optimal"] = phase.get("optimal", True) and entry["optimal"]
+    return list(summary.values())
+
+
+def tag_group(trace, group_trace, group):
+    """Add the phases of the pairing of a score group to trace, with the index of the group."""
+    if trace is not None:
+        trace.extend([dict(entry, group=group) for entry in group_trace])
 
 
 def first_pairing(player_list):
@@ -38,7 +93,7 @@ def pair(player_one, player_two, current_pairing):
     return current_pairing
 
 
-def pairing_fixing(player_list, current_pairing, number_of_matches_not_done):
+def pairing_fixing(player_list, current_pairing, number_of_matches_not_done, trace=None, depth=0, fallback=None):
     """Return a dictionary pairing all players with the player they haven't played against closest to their score.
 
     The function will first attempt to find enough players (starting with the lowest score and their pair) to be able
@@ -49,15 +104,26 @@ def pairing_fixing(player_list, current_pairing, number_of_matches_not_done):
     highest score).
     This implies that if the number of rounds is very high in comparison to the number of players, players with the
     lowest scores may end up facing each other a lot.
+    If fallback (a pairing of all players without rematches) is given, it is returned instead of enumerating more than
+    MAX_COMBINATIONS combinations.
     """
-
-    players_to_pair = get_enough_players(player_list, current_pairing, number_of_matches_not_done)
-    all_valid_pairings = get_all_valid_matchups(players_to_pair, number_of_matches_not_done)
+    with traced(trace, "pairing_fixing", depth=depth, matches_redone=number_of_matches_not_done) as entry:
+        players_to_pair = get_enough_players(player_list, current_pairing, number_of_matches_not_done)
+        entry["players_considered"] = len(players_to_pair)
+        combinations = math.comb(math.comb(len(players_to_pair), 2), number_of_matches_not_done + 1)
+        if fallback is not None and combinations > MAX_COMBINATIONS:
+            entry["candidates"] = 0
+            entry["reason"] = "too_many_combinations"
+            return fallback
+        all_valid_pairings, entry["candidates"] = get_all_valid_matchups(players_to_pair, number_of_matches_not_done)
+        entry["valid"] = len(all_valid_pairings)
     if len(all_valid_pairings) == 0:
         if number_of_matches_not_done >= len(player_list) // 2:
-            return least_played_pairing(player_list)
+            with traced(trace, "least_played_pairing", players=len(player_list), reason="no_valid_pairing"):
+                return least_played_pairing(player_list)
         else:
-            return pairing_fixing(player_list, current_pairing, number_of_matches_not_done + 1)
+            return pairing_fixing(player_list, current_pairing, number_of_matches_not_done + 1, trace, depth + 1,
+                                  fallback)
     else:
         final_pairing = all_valid_pairings[0]
     for player_one, player_two in final_pairing:
@@ -65,6 +131,90 @@ def pairing_fixing(player_list, current_pairing, number_of_matches_not_done):
     return current_pairing
 
 
+def rematch_free_pairing(player_list, current_pairing=None):
+    """Return a dictionary pairing all players without rematches, or None if there is none.
+
+    It is a maximum matching of the graph linking the players who never played against each other, found by Edmonds'
+    blossom algorithm in O(n³): starting from current_pairing, a pairing is grown along augmenting paths, whose odd
+    cycles (blossoms) are contracted to their base. The pairs of current_pairing are mostly kept."""
+    amount = len(player_list)
+    indexes = {id(player): i for i, player in enumerate(player_list)}
+    neighbours = [[j for j, other in enumerate(player_list) if j != i and not player.has_played_against(other)]
+                  for i, player in enumerate(player_list)]
+    match = [-1] * amount
+    for player_one, player_two in (current_pairing or {}).items():
+        if not player_one.has_played_against(player_two):
+            match[indexes[id(player_one)]] = indexes[id(player_two)]
+
+    def find_augmenting_path(root):
+        """Return the free player ending an augmenting path from root, with the parents along the path, or -1."""
+        used = [False] * amount
+        parent = [-1] * amount
+        base = list(range(amount))
+        used[root] = True
+        queue = [root]
+
+        def common_base(one, two):
+            seen = [False] * amount
+            while True:
+                one = base[one]
+                seen[one] = True
+                if match[one] == -1:
+                    break
+                one = parent[match[one]]
+            while True:
+                two = base[two]
+                if seen[two]:
+                    return two
+                two = parent[match[two]]
+
+        def mark_path(vertex, blossom_base, child, in_blossom):
+            while base[vertex] != blossom_base:
+                in_blossom[base[vertex]] = in_blossom[base[match[vertex]]] = True
+                parent[vertex] = child
+                child = match[vertex]
+                vertex = parent[match[vertex]]
+
+        for vertex in queue:
+            for neighbour in neighbours[vertex]:
+                if base[vertex] == base[neighbour] or match[vertex] == neighbour:
+                    continue
+                if neighbour == root or (match[neighbour] != -1 and parent[match[neighbour]] != -1):
+                    blossom_base = common_base(vertex, neighbour)
+                    in_blossom = [False] * amount
+                    mark_path(vertex, blossom_base, neighbour, in_blossom)
+                    mark_path(neighbour, blossom_base, vertex, in_blossom)
+                    for i in range(amount):
+                        if in_blossom[base[i]]:
+                            base[i] = blossom_base
+                            if not used[i]:
+                                used[i] = True
+                                queue.append(i)
+                elif parent[neighbour] == -1:
+                    parent[neighbour] = vertex
+                    if match[neighbour] == -1:
+                        return neighbour, parent
+                    used[match[neighbour]] = True
+                    queue.append(match[neighbour])
+        return -1, parent
+
+    for root in range(amount):
+        if match[root] != -1:
+            continue
+        vertex, parent = find_augmenting_path(root)
+        if vertex == -1:
+            return None
+        while vertex != -1:
+            previous = match[parent[vertex]]
+            match[vertex] = parent[vertex]
+            match[parent[vertex]] = vertex
+            vertex = previous
+    pairs = dict()
+    for i, j in enumerate(match):
+        pairs[player_list[i]] = player_list[j]
+    return pairs
+
+
 def least_played_pairing(player_without_matches):
     """Return a dictionary pairing all players with the player they have played the least against.
 
@@ -72,14 +222,40 @@ def least_played_pairing(player_without_matches):
     highest score among those they have played the least again.
     If the number of rounds is very high in comparison to the number of players, players with the
     lowest scores may end up facing each other a lot.
+
+    The players not paired yet are kept in a heap ordered by points, then by their place in the list. The opponent
+    of a player is the first one in the heap they never faced, so only the players they already faced are set aside,
+    and the least faced of those is taken if they faced everyone left. This makes the same choices as
+    Player.least_played_from, without sorting all the players left for each player.
+
+    A paired player is removed from the heap when they reach its top, once. The players set aside are pushed back, and
+    a player sets aside at most the r players they faced, so the pairing takes O(n·r·log n) for n players after r
+    rounds: O(n log n) in a usual swiss tournament, and O(n² log n) at worst, when the players faced most of the field.
     """
+    heap = [(-player.points, i, player) for i, player in enumerate(player_without_matches)]
+    heapq.heapify(heap)
     pairs = dict()
     for current_player in player_without_matches:
         if current_player in pairs:
             continue
-        possible_opponents = [player for player in player_without_matches if (player not in pairs
-                                                                              and player != current_player)]
-        least_played = current_player.least_played_from(possible_opponents)
+        faced = []
+        least_played = None
+        while heap:
+            entry = heapq.heappop(heap)
+            opponent = entry[2]
+            # The players paired since they were added are only removed from the heap when they reach its top.
+            if opponent in pairs or opponent is current_player:
+                continue
+            if opponent.name not in current_player.people_played_against:
+                least_played = opponent
+                break
+            faced.append(entry)
+        if least_played is None:
+            least_played = min(faced, key=lambda entry: (current_player.people_played_against[entry[2].name],
+                                                         entry[:2]))[2]
+        for entry in faced:
+            if entry[2] is not least_played:
+                heapq.heappush(heap, entry)
         pairs = pair(current_player, least_played, pairs)
     return pairs
 
@@ -107,7 +283,7 @@ def game_allowed(pairings):
 
 def get_all_valid_matchups(players_to_pair, number_of_matches_not_done, players_per_match=2, func=game_allowed):
     """Return a list with all possible combination of number_of_matches_not_done tuples of player_per_match
-    element from players_to_pair. The list is filtered by func."""
+    element from players_to_pair, filtered by func, and the number of combinations before filtering."""
     # First we get all possible combination (for example with (a,b,c,d) we'll get [(a,b), (a,c), (a,d), (b,c), (b,d),
     # (c,d)] (or something equivalent for our purpose))
     # Note that players_to_pair must NOT have repetitions for this to work correctly
@@ -118,4 +294,224 @@ def get_all_valid_matchups(players_to_pair, number_of_matches_not_done, players_
                                               itertools.combinations(all_pairings, number_of_matches_not_done + 1)]
     # Finally we filter the results according to our function.
     all_valid_pairings = list(filter(func, all_potential_combinations_of_pairings))
-    return all_valid_pairings
+    return all_valid_pairings, len(all_potential_combinations_of_pairings)
+
+
+def pair_group(player_list, deadline=None, trace=None):
+    """Return a dictionary pairing all players of a list, avoiding rematches when possible, and whether it is optimal.
+
+    Without a deadline, the pairing is made by first_pairing and pairing_fixing. Before pairing_fixing, which
+    enumerates combinations, rematch_free_pairing checks that a pairing without rematches exists: if there is none,
+    the players are paired by least_played_pairing at once, as pairing_fixing would after enumerating everything.
+    With a deadline (a time.time() value), it is made by anytime_pairing."""
+    if deadline is not None:
+        return anytime_pairing(player_list, deadline, trace)
+    with traced(trace, "first_pairing", players=len(player_list)) as entry:
+        pairs = first_pairing(player_list)
+        entry["pairs"] = len(pairs) // 2
+    if len(pairs) == len(player_list):
+        return pairs, True
+    with traced(trace, "rematch_free_pairing", players=len(player_list)) as entry:
+        rematch_free = rematch_free_pairing(player_list, pairs)
+        entry["found"] = rematch_free is not None
+    if rematch_free is None:
+        with traced(trace, "least_played_pairing", players=len(player_list), reason="no_valid_pairing"):
+            return least_played_pairing(player_list), True
+    return pairing_fixing(player_list, pairs, (len(player_list) - len(pairs)) // 2, trace,
+                          fallback=rematch_free), True
+
+
+def pair_group_indexes(player_list, deadline=None):
+    """Return the pairs made by pair_group as tuples of indexes in player_list, whether they are optimal and the
+    trace of the pairing.
+
+    Indexes are used instead of players because the players are copied when sent to another process."""
+    trace = []
+    pairs, optimal = pair_group(player_list, deadline, trace)
+    indexes = {id(player): i for i, player in enumerate(player_list)}
+    return [(indexes[id(player_one)], indexes[id(player_two)]) for player_one, player_two in pairs.items()
+            if indexes[id(player_one)] < indexes[id(player_two)]], optimal, trace
+
+
+def pairing_cost(player_one, player_two):
+    """Return how bad it is to pair two players: the times they already faced each other, then their score gap."""
+    return player_one.people_played_against.get(player_two.name, 0), abs(player_one.points - player_two.points)
+
+
+def add_costs(cost_one, cost_two):
+    """Return the sum of two costs."""
+    return cost_one[0] + cost_two[0], cost_one[1] + cost_two[1]
+
+
+def anytime_pairing(player_list, deadline, trace=None):
+    """Return the best dictionary pairing all players found before the deadline, and whether it is optimal.
+
+    The search starts from the pairing given by least_played_pairing, which is always complete (and which is returned
+    as is if the deadline has already passed). Then each player, starting with the highest score, is paired with the
+    remaining players ordered by cost (see pairing_cost), so that good pairings are found first. A branch is abandoned
+    as soon as its cost reaches the cost of the best pairing found so far. If the search ends before the deadline,
+    the pairing returned is optimal."""
+    with traced(trace, "anytime_pairing", players=len(player_list)) as entry:
+        best_pairs, optimal, entry["nodes"] = anytime_search(player_list, deadline)
+        entry["optimal"] = optimal
+        if not optimal:
+            entry["reason"] = "deadline"
+    return best_pairs, optimal
+
+
+def anytime_search(player_list, deadline):
+    """Do the search of anytime_pairing, and return the number of partial pairings explored with its result.
+
+    The search is a loop over a stack of branchings (one per game chosen) rather than a recursion, whose depth would
+    be half the players."""
+    best_pairs = least_played_pairing(player_list)
+    if time.time() > deadline:
+        return best_pairs, False, 0
+    best_cost = (0, 0)
+    for player_one, player_two in best_pairs.items():
+        best_cost = add_costs(best_cost, pairing_cost(player_one, player_two))
+    # Each game was counted twice, once for each player.
+    best_cost = (best_cost[0] / 2, best_cost[1] / 2)
+    nodes = 0
+    chosen = []
+    # For each game chosen (and the one being chosen), the players left, their cost and the opponents left to try.
+    branchings = []
+    remaining, cost = list(player_list), (0, 0)
+    while True:
+        nodes += 1
+        if time.time() > deadline:
+            return best_pairs, False, nodes
+        if remaining:
+            player_one = remaining[0]
+            branchings.append((remaining, cost, iter(sorted(remaining[1:], key=lambda candidate: pairing_cost(
+                player_one, candidate)))))
+        else:
+            best_cost = cost
+            best_pairs = dict()
+            for player_one, player_two in chosen:
+                pair(player_one, player_two, best_pairs)
+        # Go to the next opponent of the deepest branching whose cost stays under the best cost found.
+        while branchings:
+            if len(chosen) == len(branchings):
+                chosen.pop()
+            remaining, cost, candidates = branchings[-1]
+            player_two = next(candidates, None)
+            if player_two is not None:
+                new_cost = add_costs(cost, pairing_cost(remaining[0], player_two))
+                # The candidates are sorted by cost, so the next ones can't do better.
+                if new_cost < best_cost:
+                    chosen.append((remaining[0], player_two))
+                    remaining, cost = [player for player in remaining[1:] if player is not player_two], new_cost
+                    break
+            branchings.pop()
+        else:
+            return best_pairs, True, nodes
+
+
+def share_deadline(deadline, share):
+    """Return the deadline giving share (between 0 and 1) of the time left before deadline, or None without one."""
+    if deadline is None:
+        return None
+    now = time.time()
+    return now + max(deadline - now, 0) * share
+
+
+def score_groups(player_list):
+    """Return the players (already sorted by score) split in groups of players with the same score.
+
+    When a group has an odd number of players, its last player floats down to the top of the next group so that each
+    group can be paired on its own. Since the total is even, the last group is always even."""
+    groups = []
+    for _, group in itertools.groupby(player_list, key=lambda player: player.points):
+        group = list(group)
+        if groups and len(groups[-1]) % 2 != 0:
+            group.insert(0, groups[-1].pop())
+        groups.append(group)
+    return [group for group in groups if group]
+
+
+def has_rematch(pairs):
+    """Return True if a player of pairs has already played against their opponent."""
+    return any(player_one.has_played_against(player_two) for player_one, player_two in pairs.items())
+
+
+def score_group_pairing(player_list, workers=None, time_budget=None, trace=None):
+    """Return a dictionary pairing all players (sorted by score) by pairing each score group on its own, and whether
+    the pairing of every group is optimal.
+
+    Groups are paired concurrently in a process pool when the field is large enough. If a group can only be paired
+    with rematches, it is merged with its neighbour (the next one, or the previous one for the last group) and the
+    merged group is paired again, which ends with the whole field as a single group at worst.
+    If a time budget (in seconds) is given, the groups are paired with anytime_pairing and the whole pairing stops
+    when the budget is spent. Half of the budget goes to the groups, each getting a share in proportion to its players
+    (all of it when they are paired concurrently), and each merge gets half of what is left, so that a group that
+    can't be paired optimally doesn't leave nothing to the others."""
+    deadline = time.time() + time_budget if time_budget is not None else None
+    groups = score_groups(player_list)
+    parallel = len(player_list) >= PARALLEL_MINIMUM and len(groups) > 1
+    with traced(trace, "score_groups", players=len(player_list), groups=[len(group) for group in groups],
+                parallel=parallel):
+        if parallel:
+            # Forking while the background writer holds a lock would give the processes a lock never released.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                        mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(pair_group_indexes, groups,
+                                            itertools.repeat(share_deadline(deadline, 1 / 2))))
+            groups_pairs = [{} for _ in groups]
+            groups_optimal = [optimal for _, optimal, _ in results]
+            for i, (group, (indexes, _, group_trace), pairs) in enumerate(zip(groups, results, groups_pairs)):
+                tag_group(trace, group_trace, i)
+                for index_one, index_two in indexes:
+                    pair(group[index_one], group[index_two], pairs)
+        else:
+            groups_pairs = []
+            groups_optimal = []
+            for i, group in enumerate(groups):
+                group_trace = []
+                # The players of the merges count as many as all the players, to keep half of the budget for them.
+                players_left = sum([len(other) for other in groups[i:]]) + len(player_list)
+                pairs, optimal = pair_group(group, share_deadline(deadline, len(group) / players_left), group_trace)
+                tag_group(trace, group_trace, i)
+                groups_pairs.append(pairs)
+                groups_optimal.append(optimal)
+    while len(groups) > 1:
+        problem = next((i for i, pairs in enumerate(groups_pairs) if has_rematch(pairs)), None)
+        if problem is None:
+            break
+        first = problem if problem < len(groups) - 1 else problem - 1
+        groups[first:first + 2] = [groups[first] + groups[first + 1]]
+        group_trace = []
+        with traced(trace, "group_merge", group=first, players=len(groups[first]), reason="rematch"):
+            # The last merge, pairing the whole field, gets all that is left.
+            merged_pairs, merged_optimal = pair_group(groups[first],
+                                                      share_deadline(deadline, 1 if len(groups) == 1 else 1 / 2),
+                                                      group_trace)
+        tag_group(trace, group_trace, first)
+        groups_pairs[first:first + 2] = [merged_pairs]
+        groups_optimal[first:first + 2] = [merged_optimal]
+    pairs = dict()
+    for group_pairs in groups_pairs:
+        pairs.update(group_pairs)
+    return pairs, all(groups_optimal)
+
+
+def berger_table(player_amount):
+    """Return the Berger table for an even amount of players, as a list of rounds of (white, black) numbers.
+
+    Players are numbered from 0 in seeding order. In round r (from 0), two players i and j other than the last one
+    meet when i + j = r modulo player_amount - 1, and the player left meets the last one. Colours follow the published
+    tables: between two players, the lower number has white if their sum is odd, and the players of the first half
+    have white against the last player."""
+    cycle = player_amount - 1
+    last = player_amount - 1
+    table = []
+    for round_number in range(cycle):
+        games = []
+        for i in range(last):
+            j = (round_number - i) % cycle
+            if j == i:
+                games.insert(0, (i, last) if i < player_amount // 2 else (last, i))
+            elif i < j:
+                games.append((i, j) if (i + j) % 2 == 1 else (j, i))
+        table.append(games)
+    return table
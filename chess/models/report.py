@@ -0,0 +1,152 @@
+"""Generate static HTML and JSON reports of the tournaments, only rewriting what changed since the last run."""
+import hashlib
+import html
+import json
+import os
+
+from . import core, db
+from .translate import TRANSLATION
+
+DEFAULT_DIRECTORY = "reports"
+MANIFEST_NAME = "manifest.json"
+LABELS = TRANSLATION["report"]
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def content_hash(serialized):
+    """Return a hash of a serialized object that only changes when its content changes."""
+    return hashlib.sha256(json.dumps(serialized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def round_hash(serialized_tournament, serialized_round):
+    """Return the hash of a round, which also depends on the participants since their names are displayed."""
+    return content_hash({"participants": serialized_tournament["participants"], "round": serialized_round})
+
+
+def load_manifest(directory):
+    """Return the hashes saved during the last generation in a directory."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_file(path, content):
+    """Write content in a file, replacing it atomically so a reader never sees a half-written page."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as written_file:
+        written_file.write(content)
+    os.replace(temporary_path, path)
+
+
+def make_table(headers, rows):
+    """Return an HTML table."""
+    header = "".join([f"<th>{html.escape(str(cell))}</th>" for cell in headers])
+    lines = ["<tr>" + "".join([f"<td>{html.escape(str(cell))}</td>" for cell in row]) + "</tr>" for row in rows]
+    return "<table>\n<tr>" + header + "</tr>\n" + "\n".join(lines) + "\n</table>"
+
+
+def render_round(game_round):
+    """Return the HTML page and the JSON content of a round."""
+    rows = [(i + 1, game.white_player.name, game.black_player.name, game.score)
+            for i, game in enumerate(game_round.games)]
+    body = (f"<p>{LABELS['start']} {game_round.starting_time_text}   "
+            f"{LABELS['end']} {game_round.ending_time_text}</p>\n"
+            + make_table(LABELS["games_headers"], rows)
+            + f'\n<p><a href="index.html">{LABELS["back"]}</a></p>')
+    content = {"name": game_round.name,
+               "starting_time": game_round.starting_time_text,
+               "ending_time": game_round.ending_time_text,
+               "finished": game_round.finished,
+               "games": [{"white": white, "black": black, "score": score} for _, white, black, score in rows]}
+    return PAGE_TEMPLATE.format(title=html.escape(game_round.name), body=body), json.dumps(content, indent=1)
+
+
+def render_tournament(tournament):
+    """Return the HTML page and the JSON content with the standings of a tournament."""
+    rows = [(i + 1, player.name, player.points) for i, player in enumerate(tournament.result)]
+    links = "\n".join([f'<li><a href="round_{game_round.number}.html">{html.escape(game_round.name)}</a></li>'
+                       for game_round in tournament.rounds])
+    body = (f"<p>{html.escape(tournament.to_display)}</p>\n"
+            + make_table(LABELS["standings_headers"], rows)
+            + f"\n<ul>\n{links}\n</ul>"
+            + f'\n<p><a href="../index.html">{LABELS["back"]}</a></p>')
+    content = {"name": tournament.name,
+               "place": tournament.place,
+               "date": tournament.date_text.split(),
+               "tournament_type": tournament.type,
+               "description": tournament.description,
+               "rounds": len(tournament.rounds),
+               "max_round": tournament.max_round,
+               "standings": [{"name": name, "points": points} for _, name, points in rows]}
+    return PAGE_TEMPLATE.format(title=html.escape(tournament.name), body=body), json.dumps(content, indent=1)
+
+
+def render_index(serialized_tournaments):
+    """Return the HTML page listing all the published tournaments."""
+    links = "\n".join([f'<li><a href="{identifiant}/index.html">{html.escape(name)}</a></li>'
+                       for identifiant, name in serialized_tournaments])
+    return PAGE_TEMPLATE.format(title=LABELS["index_title"], body=f"<ul>\n{links}\n</ul>")
+
+
+def publish(directory=DEFAULT_DIRECTORY, serialized_tournaments=None):
+    """Render the tournaments in directory and return the number of tournaments and rounds that were rewritten.
+
+    The hash of each serialized tournament and of each of its rounds is kept in a manifest. A tournament whose hash
+    hasn't changed since the last generation isn't even unserialized, and only the rounds of a modified tournament
+    whose hash changed are rendered again."""
+    if serialized_tournaments is None:
+        serialized_tournaments = db.search_tournaments()
+    os.makedirs(directory, exist_ok=True)
+    old_manifest = load_manifest(directory)
+    new_manifest = {}
+    tournaments_written = rounds_written = 0
+    modified = []
+    for serialized in serialized_tournaments:
+        identifiant = db.tournament_key(serialized)
+        old_entry = old_manifest.get(identifiant, {})
+        entry = {"hash": content_hash(serialized), "name": f"{serialized['name']} {serialized['date']}", "rounds": {}}
+        if entry["hash"] == old_entry.get("hash"):
+            new_manifest[identifiant] = old_entry
+        else:
+            modified.append((identifiant, old_entry, entry, serialized))
+    # The modified tournaments are unserialized together, in the process pool if there are several cores.
+    tournaments = core.load_tournaments([serialized for *_, serialized in modified], skip_invalid=True)
+    for (identifiant, old_entry, entry, serialized), tournament in zip(modified, tournaments):
+        if tournament is None:
+            continue
+        tournament_directory = os.path.join(directory, identifiant)
+        os.makedirs(tournament_directory, exist_ok=True)
+        for game_round, serialized_round in zip(tournament.rounds, serialized["rounds"]):
+            number = str(game_round.number)
+            entry["rounds"][number] = round_hash(serialized, serialized_round)
+            if entry["rounds"][number] == old_entry.get("rounds", {}).get(number):
+                continue
+            page, content = render_round(game_round)
+            write_file(os.path.join(tournament_directory, f"round_{number}.html"), page)
+            write_file(os.path.join(tournament_directory, f"round_{number}.json"), content)
+            rounds_written += 1
+        page, content = render_tournament(tournament)
+        write_file(os.path.join(tournament_directory, "index.html"), page)
+        write_file(os.path.join(tournament_directory, "tournament.json"), content)
+        new_manifest[identifiant] = entry
+        tournaments_written += 1
+    if tournaments_written or new_manifest.keys() != old_manifest.keys():
+        write_file(os.path.join(directory, "index.html"),
+                   render_index([(identifiant, entry["name"]) for identifiant, entry in new_manifest.items()]))
+    if new_manifest != old_manifest:
+        write_file(os.path.join(directory, MANIFEST_NAME), json.dumps(new_manifest))
+    return tournaments_written, rounds_written
@@ -0,0 +1,122 @@
+"""Publish the standings and the pairings of a tournament each time it is saved, for the spectator service.
+
+A snapshot is a small JSON file that is replaced atomically, so the service (spectator.py) always reads a complete
+snapshot, without opening the database or waiting for the program. This module doesn't use the database, so that the
+service can render the snapshots without opening it."""
+import html
+import json
+import os
+import time
+
+from .translate import TRANSLATION
+
+DEFAULT_DIRECTORY = "snapshots"
+# Where the snapshots are published. None disables the snapshots.
+DIRECTORY = DEFAULT_DIRECTORY
+LABELS = TRANSLATION["spectator"]
+# The pages reload themselves, so the spectators see the new results without doing anything.
+REFRESH_SECONDS = 30
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<meta http-equiv="refresh" content="{refresh}">
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def make_snapshot(tournament):
+    """Return the standings and the pairings of the current round of a tournament, without its key, which is only
+    known once it is saved."""
+    games = tournament.rounds[-1].games if tournament.rounds else []
+    return {"name": tournament.name,
+            "place": tournament.place,
+            "date": tournament.date_text.split(),
+            "round": len(tournament.rounds),
+            "max_round": tournament.max_round,
+            "published": time.strftime("%d/%m/%Y %H:%M:%S"),
+            "standings": [{"rank": rank, "name": player.name, "points": player.points}
+                          for rank, player in enumerate(tournament.result, 1)],
+            "pairings": [{"board": board, "white": game.white_player.name, "black": game.black_player.name,
+                          "score": game.score} for board, game in enumerate(games, 1)]}
+
+
+def publish(tournament, key, directory=None):
+    """Write the snapshot of a tournament, replacing the previous one atomically."""
+    write_snapshot(make_snapshot(tournament), key, directory)
+
+
+def write_snapshot(published, key, directory=None):
+    """Write a snapshot made by make_snapshot, replacing the previous one atomically. It is skipped if the snapshots
+    are disabled or can't be written, since the tournament is saved anyway."""
+    directory = directory or DIRECTORY
+    if directory is None:
+        return
+    path = os.path.join(directory, f"{key}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as snapshot_file:
+            json.dump(dict(published, key=key), snapshot_file, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        pass
+
+
+def move_snapshot(old_key, new_key, directory=None):
+    """Publish the snapshot of a tournament whose key changed (when the database is split again) under its new key,
+    and remove the old one, whose key may be given to another tournament."""
+    directory = directory or DIRECTORY
+    if directory is None:
+        return
+    path = os.path.join(directory, f"{old_key}.json")
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            published = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return
+    write_snapshot(published, new_key, directory)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def make_table(headers, rows):
+    """Return an HTML table."""
+    header = "".join([f"<th>{html.escape(str(cell))}</th>" for cell in headers])
+    lines = ["<tr>" + "".join([f"<td>{html.escape(str(cell))}</td>" for cell in row]) + "</tr>" for row in rows]
+    return "<table>\n<tr>" + header + "</tr>\n" + "\n".join(lines) + "\n</table>"
+
+
+def render_page(title, body):
+    return PAGE_TEMPLATE.format(refresh=REFRESH_SECONDS, title=html.escape(title), body=body)
+
+
+def render_snapshot(snapshot):
+    """Return the HTML page of a snapshot."""
+    standings = [(entry["rank"], entry["name"], entry["points"]) for entry in snapshot["standings"]]
+    pairings = [(game["board"], game["white"], game["black"], game["score"]) for game in snapshot["pairings"]]
+    body = (f"<p>{html.escape(snapshot['place'])}   {html.escape(' '.join(snapshot['date']))}   "
+            f"{html.escape(LABELS['round'](snapshot['round'], snapshot['max_round']))}</p>\n"
+            f"<h2>{LABELS['pairings']}</h2>\n" + make_table(LABELS["pairings_headers"], pairings)
+            + f"\n<h2>{LABELS['standings']}</h2>\n" + make_table(LABELS["standings_headers"], standings)
+            + f"\n<p>{html.escape(LABELS['published'](snapshot['published']))}</p>"
+            + f'\n<p><a href="/">{LABELS["back"]}</a></p>')
+    return render_page(snapshot["name"], body)
+
+
+def render_index(snapshots):
+    """Return the HTML page listing the snapshots."""
+    if not snapshots:
+        return render_page(LABELS["index_title"], f"<p>{LABELS['no_tournament']}</p>")
+    links = "\n".join([f'<li><a href="/{html.escape(snapshot["key"])}">{html.escape(snapshot["name"])}</a> '
+                       f'{html.escape(" ".join(snapshot["date"]))}</li>' for snapshot in snapshots])
+    return render_page(LABELS["index_title"], f"<ul>\n{links}\n</ul>")
@@ -5,6 +5,15 @@ TRANSLATION = {
         "bullet",
         "blitz"
     ],
+    "valid_systems": {
+        "suisse": "swiss",
+        "toutes_rondes": "round_robin"
+    },
+    "valid_shardings": {
+        "saison": "season",
+        "club": "club",
+        "aucun": None
+    },
     "yes": [
         "oui",
         "o"
@@ -30,7 +39,18 @@ TRANSLATION = {
         "nom": "surname",
         "clé": "key",
         "description": "description",
-        "points": "points"
+        "points": "points",
+        "dossier": "directory",
+        "résultats": "results",
+        "fichier": "file",
+        "prénom_adversaire": "opponent_name",
+        "nom_adversaire": "opponent_surname",
+        "temps_max": "time_budget",
+        "système": "system",
+        "critère": "criterion",
+        "numéro_de_ronde": "round_number",
+        "durée": "duration",
+        "places": "places"
     },
     "command_names": {
         "créer_tournoi": "add_tournament",
@@ -53,7 +73,17 @@ TRANSLATION = {
         "finir_tour": "finish_round",
         "résultat": "give_results",
         "finir_tournoi": "finish",
-        "exit": "exit"
+        "exit": "exit",
+        "publier": "publish",
+        "résultats": "give_all_results",
+        "historique": "member_history",
+        "confrontations": "head_to_head",
+        "exporter": "export",
+        "importer": "import_trf",
+        "répartir": "split_database",
+        "trace_appariement": "display_pairing_trace",
+        "suivre_résultats": "follow_results",
+        "qui_peut_gagner": "who_can_win"
     },
     "ask_argument": {
         "name_add_tournament": "Quel est le nom du tournoi?",
@@ -80,12 +110,24 @@ TRANSLATION = {
         "surname_get_info_player": "Quel est le nom de famille du joueur dont vous voulez les détails?",
         "discriminator_get_info_player": "Quel est le discriminant du joueur dont vous voulez les détails?",
         "match_number_give_results": "Quel est le numéro du match dont vous voulez donner le résultat?",
-        "result_give_results": "Quel est le résultat du match?"
+        "result_give_results": "Quel est le résultat du match?",
+        "results_give_all_results": "Quels sont les résultats de la ronde? (numéro du match et résultat, séparés par "
+                                    "des virgules, par exemple: 1 1-0, 2 1/2-1/2, 3 0-1)",
+        "name_member_history": "Quel est le prénom du membre dont vous voulez l'historique?",
+        "surname_member_history": "Quel est le nom de famille du membre dont vous voulez l'historique?",
+        "name_head_to_head": "Quel est le prénom du premier membre?",
+        "surname_head_to_head": "Quel est le nom de famille du premier membre?",
+        "opponent_name_head_to_head": "Quel est le prénom du second membre?",
+        "opponent_surname_head_to_head": "Quel est le nom de famille du second membre?",
+        "file_import_trf": "Quel est le chemin du fichier TRF à importer?",
+        "criterion_split_database": "Comment répartir les tournois? (saison, club ou aucun)",
+        "file_follow_results": "Quel est le chemin du fichier (ou du dossier) où les résultats sont écrits?"
     },
     "fix_argument": {
         "birthdate": "La date de naissance n'est pas valide, entrez une date correcte (au format jj/mm/aaaa).",
         "discriminator": "Le discriminant du joueur doit être un nombre positif. Entrez un entier positif.",
         "match_number": "Le numéro du match doit être un nombre. Entrez un entier positif.",
+        "round_number": "Le numéro de la ronde doit être un nombre. Entrez un entier positif.",
         "max_round": "Le nombre de rondes doit être un nombre. Entrez un entier positif.",
         "new_ranking": "Le nouveau classement du joueur doit être un nombre. Entrez un entier positif.",
         "participant_amount": "Le nombre de participants doit être un nombre. Entrez un entier positif.",
@@ -94,10 +136,16 @@ TRANSLATION = {
         "tournament_date": "La date du tournoi n'est pas valide, entrez une date correcte (au format jj/mm/aaaa avec "
                            "des espaces entre chaque date s'il y en a plusieurs.",
         "tournament_type": "Le contrôle de temps du tournoi ne fait pas partie des noms autorisés. "
-                           "Indiquez un nom valide."
+                           "Indiquez un nom valide.",
+        "system": "Le système d'appariement n'est pas valide. Indiquez suisse ou toutes_rondes.",
+        "time_budget": "Le temps maximal doit être un nombre de secondes positif. Entrez un nombre positif.",
+        "criterion": "La répartition n'est pas valide. Indiquez saison, club ou aucun.",
+        "duration": "La durée doit être un nombre de secondes positif. Entrez un nombre positif.",
+        "places": "Le nombre de places doit être un nombre. Entrez un entier positif."
     },
     "welcome": "Bienvenue dans le logiciel de gestion de tournois d'échecs.",
     "main_ask": "Que voulez-vous faire?",
+    "main_ask_saving": "Que voulez-vous faire? (sauvegarde en cours)",
     "controller": {
         "tournament_already_exists": "Un tournoi avec le même nom, la même date et le même lieu existe déjà dans la "
                                      "base de données. Le tournoi n'a pas été créé.",
@@ -110,6 +158,9 @@ TRANSLATION = {
         "no_member_in_DB": "Il n'y a personne avec ce nom dans la base de données!",
         "can't_sort": lambda key: f"Il est impossible de trier selon {key}.",
         "odd_number": "Vous ne pouvez pas avoir un nombre impair de joueurs. Le tournoi n'a pas été créé.",
+        "invalid_round_amount": lambda rounds: f"Un tournoi toutes rondes avec ce nombre de joueurs doit avoir "
+                                               f"{rounds} rondes (ou {2 * rounds} en aller-retour). Le tournoi n'a "
+                                               f"pas été créé.",
         "created_tournament": "Tournoi créé!\nVous êtes désormais dans la gestion de ce nouveau tournoi.",
         "member_added": "La personne a été correctement ajoutée à la base de données!",
         "ranking_changed": "Le classement du joueur a été correctement changé!",
@@ -150,10 +201,14 @@ TRANSLATION = {
         "all_rounds_played": "Toutes les rondes prévues ont déjà été jouées!",
         "tournament_not_started": "Le tournoi n'est pas encore lancé!",
         "round_created": "La prochaine ronde a été créée!",
+        "pairing_not_optimal": "Le temps maximal a été atteint: les appariements sont les meilleurs trouvés, mais "
+                               "pas forcément les meilleurs possibles.",
         "game_not_finished": lambda name: f"Le match {name} n'est pas fini.",
         "round_already_finished": "La ronde est déjà finie.",
         "round_finished": "La ronde actuelle a bien été finie.",
         "game_doesn't_exist": "Ce match n'existe pas.",
+        "round_doesn't_exist": "Cette ronde n'existe pas.",
+        "no_pairing_trace": "Aucune trace d'appariement n'a été enregistrée pour cette ronde.",
         "game_already_has_score": "Le résultat du match a déjà été entré.",
         "validation_result": lambda name, result: f"Le résultat de {name} va être {result}. Il ne pourra plus être "
                                                   f"changé après. Êtes-vous sûr de vouloir valider? (o/n)",
@@ -162,7 +217,47 @@ TRANSLATION = {
         "result_not_ok": "Le résultat n'a pas été validé.",
         "tournament_not_finished": "Le tournoi n'est pas fini! Il reste une ou plusieurs rondes à jouer ou "
                                    "à terminer.",
-        "back_main_menu": "Retour au menu principal!"
+        "back_main_menu": "Retour au menu principal!",
+        "save_conflict": "Le tournoi a été modifié depuis un autre terminal et les modifications ne peuvent pas être "
+                         "fusionnées. Les dernières modifications n'ont pas été sauvegardées: quittez puis rechargez "
+                         "le tournoi.",
+        "drop_changes": "Les modifications qui n'ont pas pu être sauvegardées seront perdues. Voulez-vous quand même "
+                        "quitter le tournoi? (o/n)",
+        "changes_kept": "Vous restez dans le tournoi. Notez les résultats qui n'ont pas été sauvegardés avant de "
+                        "quitter, pour les entrer après avoir rechargé le tournoi.",
+        "file_not_readable": lambda file: f"Le fichier {file} ne peut pas être lu.",
+        "invalid_entry": lambda entry: f"'{entry}' n'est pas un numéro de match suivi d'un résultat valide.",
+        "entry_game_doesn't_exist": lambda number: f"Le match {number} n'existe pas.",
+        "entry_duplicated": lambda number: f"Le match {number} apparaît plusieurs fois.",
+        "entry_already_has_score": lambda number: f"Le résultat du match {number} a déjà été entré.",
+        "entries_already_applied": lambda numbers: f"Résultat(s) déjà entré(s), ignoré(s): match(s) {numbers}.",
+        "invalid_results": lambda errors: f"Aucun résultat n'a été validé:\n{errors}",
+        "no_results": "Aucun résultat n'a été donné.",
+        "validation_results": lambda summary: f"Les résultats suivants vont être validés:\n{summary}\nIls ne pourront "
+                                              f"plus être changés après. Êtes-vous sûr de vouloir valider? (o/n)",
+        "results_ok": lambda number: f"{number} résultat(s) validé(s)!",
+        "following_results": lambda file: f"Les résultats écrits dans {file} sont appliqués au fur et à mesure. "
+                                          f"Appuyez sur Ctrl+C pour arrêter.",
+        "results_followed": lambda number: f"{number} résultat(s) appliqué(s) et sauvegardé(s).",
+        "not_last_round": "Les places possibles ne peuvent être calculées qu'une fois la dernière ronde créée.",
+        "can_still_win": lambda names: f"Peuvent encore finir premiers: {names}",
+        "can_reach_places": lambda places, names: f"Peuvent encore finir dans les {places} premiers: {names}",
+        "sure_of_places": lambda places, names: f"Sont sûrs de finir dans les {places} premiers: {names}",
+        "no_history": "Ce membre n'a joué aucun match.",
+        "never_met": "Ces deux membres ne se sont jamais affrontés.",
+        "head_to_head": lambda games, wins, draws, losses: f"{games} match(s) joué(s): {wins} victoire(s), "
+                                                           f"{draws} nulle(s), {losses} défaite(s).",
+        "published": lambda tournaments, rounds: f"Rapports publiés: {tournaments} tournoi(s) et {rounds} ronde(s) "
+                                                 f"ont été regénérés.",
+        "exported": lambda trf_path, pgn_path: f"Le tournoi a été exporté dans {trf_path} et ses matchs dans "
+                                               f"{pgn_path}.",
+        "imported": lambda name, players, created: f"Le tournoi {name} a été importé avec {players} joueurs, dont "
+                                                   f"{created} nouveau(x) membre(s).",
+        "invalid_trf": lambda line_number: f"La ligne {line_number} du fichier TRF n'est pas valide. Le tournoi n'a "
+                                           f"pas été importé." if line_number else "Le fichier TRF ne donne pas le "
+                                           "nom ou la date du tournoi. Le tournoi n'a pas été importé.",
+        "database_split": lambda moved: f"La base de données a été répartie: {moved} tournoi(s) déplacé(s).",
+        "odd_number_trf": "Le fichier TRF a un nombre impair de joueurs. Le tournoi n'a pas été importé."
     },
     "headers": {
         "member_choice": "nom   prénom   date de naissance   genre   classement   discriminant",
@@ -170,8 +265,79 @@ TRANSLATION = {
         "player_display": "nom complet   points",
         "rounds_display": "nom   heure de début   heure de fin",
         "games_display": "nom de la partie   score",
-        "result": "place   nom complet   points"
+        "result": "place   nom complet   points",
+        "history_display": "tournoi   date(s)   points\n    ronde   couleur   adversaire   score",
+        "head_to_head_display": "tournoi   ronde   couleur   score",
+        "pairing_trace_display": "étape   groupe   durée   détails",
+        "reachable_ranks_display": "nom complet   points   meilleure place possible   pire place possible"
+    },
+    "pairing_trace": {
+        "phases": {
+            "ranking_halves": "moitiés du classement (première ronde)",
+            "berger_schedule": "table de Berger",
+            "score_groups": "groupes de points",
+            "first_pairing": "premier appariement",
+            "rematch_free_pairing": "recherche d'un appariement sans revanche",
+            "pairing_fixing": "désappariement",
+            "least_played_pairing": "appariement des moins affrontés",
+            "anytime_pairing": "recherche limitée dans le temps",
+            "group_merge": "fusion de groupes"
+        },
+        "details": {
+            "players": "joueurs",
+            "groups": "tailles des groupes",
+            "parallel": "en parallèle",
+            "pairs": "paires trouvées",
+            "found": "trouvé",
+            "depth": "profondeur",
+            "matches_redone": "matchs refaits",
+            "players_considered": "joueurs désappariés",
+            "runs": "exécutions",
+            "candidates": "combinaisons énumérées",
+            "valid": "combinaisons valides",
+            "nodes": "branches explorées",
+            "optimal": "optimal",
+            "reason": "raison"
+        },
+        "reasons": {
+            "no_valid_pairing": "aucun appariement sans revanche",
+            "deadline": "temps maximal atteint",
+            "rematch": "revanche dans un groupe",
+            "too_many_combinations": "trop de combinaisons, appariement sans revanche pris tel quel"
+        }
+    },
+    "trf_genders": {
+        "m": "Homme",
+        "w": "Femme"
     },
+    "colors": {
+        "white": "blancs",
+        "black": "noirs"
+    },
+    "report": {
+        "index_title": "Tournois",
+        "start": "Commencé à",
+        "end": "Fini à",
+        "back": "Retour",
+        "games_headers": ["numéro", "blanc", "noir", "score"],
+        "standings_headers": ["place", "nom complet", "points"]
+    },
+    "spectator": {
+        "index_title": "Tournois",
+        "no_tournament": "Aucun tournoi n'a encore été publié.",
+        "not_found": "Ce tournoi n'a pas été publié.",
+        "round": lambda number, max_round: f"Ronde {number}/{max_round}",
+        "pairings": "Appariements de la ronde",
+        "standings": "Classement",
+        "published": lambda moment: f"Mis à jour le {moment}",
+        "back": "Retour",
+        "pairings_headers": ["échiquier", "blanc", "noir", "score"],
+        "standings_headers": ["place", "nom complet", "points"]
+    },
+    "pager": "-- Entrée pour continuer, q pour arrêter --",
+    "pager_quit": [
+        "q"
+    ],
     "invalid_command_argument": "La fonction n'est pas un appel valide, ou un des arguments n'existe pas.  "
                                 "Lisez le readme pour obtenir plus d'informations.",
     "invalid_command": "La fonction n'est pas un appel valide."
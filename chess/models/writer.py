@@ -0,0 +1,137 @@
+"""Implement an optional thread saving tournaments and members in the background.
+
+When the writer is running, save() takes what the object has to save (see core.TournamentSave) and returns
+immediately. The thread waits a short delay so that the saves requested in a burst are merged, then writes the last
+save of each object once. It only writes what was taken, so it never reads the objects a command may be changing.
+Reads don't wait for the pending saves: the database gives them in place of what is written (see db.pending_saves).
+
+A tournament saved by another process in the meantime is merged by the thread; the merged version is merged in the
+tournament itself by merge_written, called by the main loop between commands."""
+import threading
+
+from . import db
+
+WRITER = None
+
+
+class BackgroundWriter:
+    """A thread writing the pending saves, each object being written once per burst of saves."""
+
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        # The saves waiting to be written, and those being written, which are still read until they are written.
+        self.dirty = {}
+        self.writing = {}
+        # The objects and their saves merged with another version when they were written.
+        self.merged = []
+        self.errors = []
+        self.running = False
+        self.condition = threading.Condition()
+        # Held while writing, by the thread or by the main thread when it flushes.
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def pending(self):
+        """The number of objects waiting to be written."""
+        with self.condition:
+            return len(self.dirty) + len(self.writing)
+
+    def request(self, saved_object):
+        """Take what an object has to save, to be written by the thread. It is called by the command changing the
+        object, so what is taken is always complete."""
+        pending_save = saved_object.pending_save()
+        with self.condition:
+            previous = self.dirty.get(pending_save.key)
+            if previous is not None:
+                _, previous_save = previous
+                pending_save.follow(previous_save)
+            self.dirty[pending_save.key] = (saved_object, pending_save)
+            self.condition.notify()
+
+    def pending_saves(self, path):
+        """Return the saves of a database file that aren't written yet, the most recent last."""
+        with self.condition:
+            return [pending_save for _, pending_save in list(self.writing.values()) + list(self.dirty.values())
+                    if pending_save.path == path]
+
+    def flush(self):
+        """Write all the pending saves now, in the calling thread."""
+        with self.write_lock:
+            with self.condition:
+                self.writing, self.dirty = self.dirty, {}
+            for key, (saved_object, pending_save) in list(self.writing.items()):
+                try:
+                    pending_save.write()
+                except Exception as error:
+                    self.errors.append(error)
+                else:
+                    if pending_save.merged:
+                        self.merged.append((saved_object, pending_save))
+                with self.condition:
+                    del self.writing[key]
+
+    def merge_written(self):
+        """Merge in the objects the versions written after merging the changes of another process. It must be called
+        by the thread running the commands, between two commands."""
+        merged, self.merged = self.merged, []
+        for saved_object, pending_save in merged:
+            try:
+                saved_object.merge(pending_save.serialized)
+            except Exception as error:
+                self.errors.append(error)
+
+    def take_errors(self):
+        """Return the errors raised by the saves made since the last call, and forget them."""
+        errors, self.errors = self.errors, []
+        return errors
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.dirty:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            # Waiting lets the next saves of the burst join the same write.
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, timeout=self.delay)
+            self.flush()
+
+    def start(self):
+        self.running = True
+        db.pending_saves = self.pending_saves
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread after writing everything that is pending."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+        db.pending_saves = None
+
+
+def start(delay=0.5):
+    """Start saving in the background."""
+    global WRITER
+    WRITER = BackgroundWriter(delay)
+    WRITER.start()
+    return WRITER
+
+
+def stop():
+    """Write everything that is pending and go back to saving immediately."""
+    global WRITER
+    if WRITER is not None:
+        WRITER.stop()
+        WRITER = None
+
+
+def flush():
+    """Write everything that is pending, if saves are made in the background, and merge what was merged while
+    writing. It must be called by the thread running the commands."""
+    if WRITER is not None:
+        WRITER.flush()
+        WRITER.merge_written()
@@ -0,0 +1,188 @@
+"""Record the sessions of the program, and replay them to check their output and measure the speed of the commands.
+
+Record a session with `python __main__.py --enregistrer session.json`. The answers typed by the user, everything
+displayed after each answer and the database as it was at the start are saved when the program closes. Replay it
+from the chess folder with `python session.py session.json`: it runs without any input on a scratch copy of the
+database, as fast as possible, then prints the outputs that changed, the commands per second and the latency of each
+command. It exits with an error if any output changed."""
+import argparse
+import json
+import os
+import random
+import re
+import runpy
+import statistics
+import tempfile
+import time
+
+import views
+from models import db, snapshot
+
+SESSION_VERSION = 1
+# The rounds are timed with the clock, so the times displayed can't be the same when replaying.
+TIME_PATTERN = re.compile(r"\b\d\d:\d\d\b")
+
+
+class SessionOver(Exception):
+    """Raised when a replayed session has no answer left."""
+
+
+def snapshot_database():
+    """Return the whole content of the database in use, and the content of each of its other shards by name."""
+    with db.LOCK:
+        shards = {shard.name: shard.database.storage.read() or {} for shard in db.all_shards()}
+    return shards.pop(""), shards
+
+
+class RecordingView(views.View):
+    """A view recording every answer of the user and everything displayed after it."""
+
+    def __init__(self, path, background_save=False, page=True):
+        super().__init__(page)
+        self.path = path
+        # The colours of the players are drawn at random, so the replay draws them with the same seed.
+        self.seed = random.randrange(2 ** 32)
+        random.seed(self.seed)
+        self.output = []
+        database, shards = snapshot_database()
+        self.session = {"version": SESSION_VERSION,
+                        "seed": self.seed,
+                        "background_save": background_save,
+                        "database": database,
+                        "shards": shards,
+                        "output": self.output,
+                        "steps": []}
+
+    def display(self, text):
+        super().display(text)
+        self.output.append(str(text))
+
+    def read(self, text):
+        answer = super().read(text)
+        self.output = []
+        self.session["steps"].append({"answer": answer, "output": self.output})
+        return answer
+
+    def read_page_answer(self):
+        # The pages depend on the size of the terminal, so the replay skips the answers given to the pager.
+        answer = super().read_page_answer()
+        self.session["steps"][-1]["pager"] = True
+        return answer
+
+    def save(self):
+        """Write the session recorded so far."""
+        with open(self.path, "w", encoding="utf-8") as session_file:
+            json.dump(self.session, session_file, ensure_ascii=False, indent=1)
+
+
+class ReplayView(views.View):
+    """A view giving the recorded answers, keeping what is displayed and timing each command."""
+
+    def __init__(self, session):
+        super().__init__(page=False)
+        self.answers = [answer for answer, _ in command_steps(session)[1]]
+        self.outputs = [[]]
+        self.latencies = {}
+        self.command = None
+        self.started = None
+
+    def display(self, text):
+        self.outputs[-1].append(str(text))
+
+    def read(self, text):
+        if len(self.outputs) > len(self.answers):
+            raise SessionOver
+        answer = self.answers[len(self.outputs) - 1]
+        self.outputs.append([])
+        return answer
+
+    def ask_command(self, text):
+        self.stop_timer()
+        answer = self.read(text)
+        self.command = answer.split("--")[0].strip().lower()
+        self.started = time.perf_counter()
+        return views.parse(answer)
+
+    def stop_timer(self):
+        """Count the time since the last command was given as the latency of that command."""
+        if self.command is not None:
+            self.latencies.setdefault(self.command, []).append(time.perf_counter() - self.started)
+            self.command = None
+
+
+def command_steps(session):
+    """Return the output of the start of a session, then the (answer, output) of each step but the answers given to
+    the pager, whose outputs are added to the output of the step before."""
+    steps = [(None, list(session["output"]))]
+    for step in session["steps"]:
+        if step.get("pager"):
+            steps[-1][1].extend(step["output"])
+        else:
+            steps.append((step["answer"], list(step["output"])))
+    return steps[0][1], steps[1:]
+
+
+def normalize(output):
+    return [TIME_PATTERN.sub("--:--", line) for line in output]
+
+
+def replay(session, directory):
+    """Replay a session on a copy of its database in directory. Return the replay view and the total duration."""
+    path = os.path.join(directory, "db.json")
+    with open(path, "w", encoding="utf-8") as database_file:
+        json.dump(session["database"], database_file)
+    for name, shard in session.get("shards", {}).items():
+        with open(os.path.join(directory, f"db_{name}.json"), "w", encoding="utf-8") as shard_file:
+            json.dump(shard, shard_file)
+    db.use_database(path)
+    snapshot.DIRECTORY = os.path.join(directory, snapshot.DEFAULT_DIRECTORY)
+    program = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "__main__.py"),
+                             run_name="program")
+    random.seed(session["seed"])
+    view = ReplayView(session)
+    start = time.perf_counter()
+    try:
+        program["main"](background_save=session["background_save"], view=view)
+    except SessionOver:
+        pass
+    view.stop_timer()
+    duration = time.perf_counter() - start
+    db.DATABASE.close()
+    return view, duration
+
+
+def differences(session, view):
+    """Return the index of the answer after which the output changed (0 for the start), with both outputs."""
+    start_output, steps = command_steps(session)
+    expected = [start_output] + [output for _, output in steps]
+    found = view.outputs + [[]] * (len(expected) - len(view.outputs))
+    return [(index, expected_output, output) for index, (expected_output, output) in enumerate(zip(expected, found))
+            if normalize(expected_output) != normalize(output)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session", help="a session recorded with __main__.py --enregistrer")
+    arguments = parser.parse_args()
+    with open(arguments.session, encoding="utf-8") as session_file:
+        session = json.load(session_file)
+    with tempfile.TemporaryDirectory() as directory:
+        view, duration = replay(session, directory)
+    changes = differences(session, view)
+    for index, expected_output, output in changes:
+        answer = command_steps(session)[1][index - 1][0] if index else "(start)"
+        print(f"Output changed after answer {index} {answer!r}:")
+        print("  expected: " + "\n            ".join(expected_output))
+        print("  got:      " + "\n            ".join(output))
+    commands = sum(len(latencies) for latencies in view.latencies.values())
+    print(f"{len(view.outputs) - 1} answers, {commands} commands in {duration:.3f}s "
+          f"({commands / duration if duration else 0:.1f} commands per second)")
+    for command, latencies in sorted(view.latencies.items()):
+        print(f"{command:<24}count={len(latencies)}  median_seconds={statistics.median(latencies):.6f}  "
+              f"max_seconds={max(latencies):.6f}")
+    if changes:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Serve the standings and the pairings of the tournaments to the spectators, read only, over HTTP.
+
+Run it from the chess folder with `python spectator.py`, then open http://127.0.0.1:8000 (use --adresse 0.0.0.0 to
+let the phones of the venue network connect). The pages are rendered from the snapshots that the program publishes
+each time a tournament is saved: the service never opens the database and never talks to the program. Each snapshot
+is read and rendered once after it changed, then served from memory to all the readers, each request being handled
+in its own thread."""
+import argparse
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from models import snapshot
+
+
+class SnapshotCache:
+    """The snapshots of a directory, with their pages, read again only when their file was replaced."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # (inode, modification time, snapshot, page, JSON content) by key.
+        self.entries = {}
+
+    def get(self, key):
+        """Return the snapshot, the page and the JSON content of a tournament, or None if it isn't published."""
+        path = os.path.join(self.directory, f"{key}.json")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(key)
+        if entry is None or entry[:2] != (stat.st_ino, stat.st_mtime_ns):
+            with self.lock:
+                try:
+                    with open(path, "rb") as snapshot_file:
+                        content = snapshot_file.read()
+                    published = json.loads(content)
+                except (OSError, ValueError):
+                    return None
+                entry = (stat.st_ino, stat.st_mtime_ns, published,
+                         snapshot.render_snapshot(published).encode("utf-8"), content)
+                self.entries[key] = entry
+        return entry[2:]
+
+    def keys(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted([name[:-len(".json")] for name in names if name.endswith(".json")])
+
+    def index(self):
+        """Return the page listing all the published tournaments."""
+        snapshots = [entry[0] for entry in map(self.get, self.keys()) if entry is not None]
+        return snapshot.render_index(snapshots).encode("utf-8")
+
+
+class SpectatorHandler(BaseHTTPRequestHandler):
+    """Answer GET / (the list of the tournaments), /<tournament> (its page) and /<tournament>.json (its snapshot)."""
+    cache = None
+
+    def do_GET(self):
+        path = self.path.split("?")[0].strip("/")
+        if not path:
+            return self.answer(200, "text/html", self.cache.index())
+        key = path[:-len(".json")] if path.endswith(".json") else path
+        entry = self.cache.get(key) if "/" not in key and key not in ("", ".", "..") else None
+        if entry is None:
+            return self.answer(404, "text/html", snapshot.render_page(snapshot.LABELS["not_found"], "")
+                               .encode("utf-8"))
+        _, page, content = entry
+        if path.endswith(".json"):
+            return self.answer(200, "application/json", content)
+        return self.answer(200, "text/html", page)
+
+    def answer(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", f"max-age={snapshot.REFRESH_SECONDS // 3}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SpectatorServer(ThreadingHTTPServer):
+    """A server handling each request in a thread, keeping waiting the connections of hundreds of readers instead
+    of refusing them."""
+    daemon_threads = True
+    request_queue_size = socket.SOMAXCONN
+
+
+def make_server(directory=snapshot.DEFAULT_DIRECTORY, address="127.0.0.1", port=8000):
+    """Return the server of the snapshots of directory, to be run with serve_forever."""
+    handler = type("Handler", (SpectatorHandler,), {"cache": SnapshotCache(directory)})
+    return SpectatorServer((address, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dossier", default=snapshot.DEFAULT_DIRECTORY, help="the folder of the snapshots")
+    parser.add_argument("--adresse", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8000)
+    arguments = parser.parse_args()
+    server = make_server(arguments.dossier, arguments.adresse, arguments.port)
+    print(f"http://{arguments.adresse}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
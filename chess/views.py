@@ -1,41 +1,87 @@
 """Implement a class that will manage interactions with the user"""
+import shutil
+import sys
+from contextlib import contextmanager
+
 from models.translate import TRANSLATION
 
 ASK_ARGUMENT = TRANSLATION["ask_argument"]
 FIX_ARGUMENT = TRANSLATION["fix_argument"]
+PAGER_TEXT = TRANSLATION["pager"]
+PAGER_QUIT_WORDS = TRANSLATION["pager_quit"]
 
 
 class View:
-    def __init__(self):
-        pass
+    def __init__(self, page=True):
+        # While a command runs, its output is kept in the buffer to be written at once.
+        self.buffer = None
+        self.page = page
+
+    def display(self, text):
+        """Write text in the console, or keep it until the end of the command if the output is buffered."""
+        if self.buffer is None:
+            print(text)
+        else:
+            self.buffer.append(str(text))
+
+    @contextmanager
+    def buffered(self):
+        """Keep everything displayed in the block and write it all at once at the end of the block."""
+        self.buffer = []
+        try:
+            yield
+        finally:
+            self.flush()
+            self.buffer = None
+
+    def flush(self, page=True):
+        """Write everything kept in the buffer, one page at a time if it doesn't fit in the terminal. Commands that
+        display while they run on their own (without waiting for the user) flush without paging."""
+        if not self.buffer:
+            return
+        lines = "\n".join(self.buffer).split("\n")
+        self.buffer.clear()
+        height = shutil.get_terminal_size().lines - 1
+        if len(lines) <= height or not (page and self.page and sys.stdin.isatty() and sys.stdout.isatty()):
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            return
+        for start in range(0, len(lines), height):
+            sys.stdout.write("\n".join(lines[start:start + height]) + "\n")
+            sys.stdout.flush()
+            if start + height < len(lines) and self.read_page_answer().strip().lower() in PAGER_QUIT_WORDS:
+                return
+
+    def read(self, text):
+        """Return a line typed by the user. Every answer of the user is read here."""
+        return input(text)
 
-    @staticmethod
-    def display(text):
-        """Write text in the console."""
-        print(text)
+    def read_page_answer(self):
+        """Return the answer of the user after a page (to display the next one or to stop)."""
+        return self.read(PAGER_TEXT)
 
-    @staticmethod
-    def ask(text):
+    def ask(self, text):
         """Return the input of an user after a question."""
-        answer = input(text).strip()
+        self.flush()
+        answer = self.read(text).strip()
         return answer
 
-    @staticmethod
-    def ask_command(text):
+    def ask_command(self, text):
         """Return a tuple that contains a command and its arguments."""
-        answer = input(text)
+        self.flush()
+        answer = self.read(text)
         return parse(answer)
 
-    @staticmethod
-    def ask_argument(argument):
+    def ask_argument(self, argument):
         """Return an input from the user for a specific argument."""
-        answer = input(ASK_ARGUMENT[argument]).strip()
+        self.flush()
+        answer = self.read(ASK_ARGUMENT[argument]).strip()
         return answer
 
-    @staticmethod
-    def ask_correct_argument(argument):
+    def ask_correct_argument(self, argument):
         """Return an input from the user for a specific argument that was invalid."""
-        answer = input(FIX_ARGUMENT[argument]).strip()
+        self.flush()
+        answer = self.read(FIX_ARGUMENT[argument]).strip()
         return answer
 
 
@@ -0,0 +1,41 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "chess"))
+
+from models import cache, core, db, writer  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Run the test in a scratch folder with an empty database."""
+    monkeypatch.chdir(tmp_path)
+    db.use_database(str(tmp_path / "db.json"))
+    cache.CACHE.clear()
+    yield db
+    writer.stop()
+    for shard in db.SHARDS.values():
+        shard.database.close()
+
+
+def make_tournament(player_amount=8, max_round=4, rounds_played=0, name="Open", seed=1):
+    """Save player_amount members and a started tournament where rounds_played rounds are played at random."""
+    randomizer = random.Random(seed)
+    tournament = core.Tournament(name=name, place="Paris", date="01/01/2021 02/01/2021", max_round=max_round,
+                                 participant_amount=player_amount, tournament_type="blitz", description="")
+    for number in range(player_amount):
+        member = core.Member(surname=f"Nom{number}", name=f"Prénom{number}", birthdate="01/01/1990", gender="m",
+                             ranking=str(1000 + number))
+        member.save()
+        tournament.add_participant(member)
+    tournament.start()
+    for _ in range(rounds_played):
+        tournament.create_round()
+        for game in tournament.rounds[-1].games:
+            game.set_score(randomizer.choice(["1-0", "0-1", "1/2-1/2"]))
+        tournament.rounds[-1].finish()
+    tournament.save()
+    return tournament
@@ -0,0 +1,28 @@
+from models import db, history
+
+from conftest import make_tournament
+
+
+def test_a_save_writes_the_tournament_and_the_changed_history_at_once(database, monkeypatch):
+    tournament = make_tournament(rounds_played=1)
+    tournament.create_round()
+    tournament.save()
+    written = []
+    original_write = db.LockedJSONStorage.write
+    monkeypatch.setattr(db.LockedJSONStorage, "write", lambda storage, data: (written.append(data),
+                                                                              original_write(storage, data)))
+    game = tournament.rounds[-1].games[0]
+    game.set_score("1-0")
+    tournament.save()
+    assert len(written) == 1
+    key = db.tournament_key(db.search_tournaments()[0])
+    changed = [member_id for member_id, entries in written[0]["history"].items() if len(entries[key]["games"]) == 2]
+    assert sorted(changed) == sorted([str(game.white_player.member.doc_id), str(game.black_player.member.doc_id)])
+
+
+def test_the_history_is_read_from_its_index(database, monkeypatch):
+    tournament = make_tournament(rounds_played=2)
+    member = tournament.participants[0]
+    monkeypatch.setattr(db.LockedJSONStorage, "read", lambda storage: 1 / 0)
+    entries = history.member_history(member.doc_id)
+    assert len(list(entries.values())[0]["games"]) == 2
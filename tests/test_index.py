@@ -0,0 +1,29 @@
+import os
+
+from models import core, db, index
+
+
+def test_an_index_of_a_version_of_the_same_size_and_time_doesnt_match(database, monkeypatch):
+    member = core.Member(surname="Nom", name="Prénom", birthdate="01/01/1990", gender="m", ranking="1000")
+    member.save()
+    members_index = index.index_path(db.MAIN_SHARD.path, "members")
+    with open(members_index, "rb") as index_file:
+        old_index = index_file.read()
+    stat = os.stat(db.MAIN_SHARD.path)
+    original_write_file = db.LockedJSONStorage.write_file
+
+    def write_file_in_the_same_tick(storage, data):
+        # A file system clock coarser than a write gives the new version the time of the previous one.
+        original_write_file(storage, data)
+        os.utime(storage.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    monkeypatch.setattr(db.LockedJSONStorage, "write_file", write_file_in_the_same_tick)
+    member.ranking = 2000
+    member.save()
+    assert os.stat(db.MAIN_SHARD.path).st_size == stat.st_size
+    # The index of the previous version couldn't be replaced (as when another process reads it on Windows).
+    with index.LOCK:
+        index.close_index(members_index)
+        with open(members_index, "wb") as index_file:
+            index_file.write(old_index)
+    assert db.get_members([member.doc_id])[0]["ranking"] == 2000
@@ -0,0 +1,17 @@
+from models import core, db
+
+from conftest import make_tournament
+
+
+def test_tournaments_built_by_the_pool_share_their_members(database):
+    for number in range(2 * core.MIN_CHUNK_SIZE):
+        make_tournament(name=f"Open{number}", rounds_played=2, seed=number)
+    serialized_tournaments = db.search_tournaments()
+    in_process = core.unserialize_tournaments(serialized_tournaments, workers=1)
+    in_pool = core.unserialize_tournaments(serialized_tournaments, workers=2)
+    assert [tournament.to_dict for tournament in in_pool] == [tournament.to_dict for tournament in in_process]
+    members = {}
+    for tournament in in_pool:
+        for participant, player in zip(tournament.participants, tournament.players):
+            assert members.setdefault(participant.doc_id, participant) is participant
+            assert player.member is participant
@@ -0,0 +1,94 @@
+import itertools
+import random
+import sys
+import time
+
+import pytest
+
+from models import core, pairing
+
+
+class Opponent:
+    def __init__(self, name, points=0):
+        self.name = name
+        self.points = points
+        self.people_played_against = {}
+
+    def has_played_against(self, player):
+        return player.name in self.people_played_against
+
+
+def play(player_amount, rounds, seed):
+    """Return an unsaved tournament where rounds rounds were paired and played at random."""
+    randomizer = random.Random(seed)
+    tournament = core.Tournament(name="Open", place="Paris", date="01/01/2021", max_round=rounds,
+                                 participant_amount=player_amount, tournament_type="blitz", description="")
+    for number in range(player_amount):
+        tournament.add_participant(core.Member(surname=f"Nom{number}", name=f"Prénom{number}",
+                                               birthdate="01/01/1990", gender="m", ranking=str(1000 + number)))
+    tournament.start()
+    for _ in range(rounds):
+        tournament.create_round()
+        for game in tournament.rounds[-1].games:
+            game.set_score(randomizer.choice(["1-0", "0-1", "1/2-1/2"]))
+        tournament.rounds[-1].finish()
+    return tournament
+
+
+@pytest.mark.parametrize("player_amount, rounds", [(12, 10), (20, 12)])
+def test_fields_where_rematches_are_hard_to_avoid_are_paired_quickly(player_amount, rounds):
+    for seed in (1, 2, 3):
+        start = time.perf_counter()
+        play(player_amount, rounds, seed)
+        assert time.perf_counter() - start < 5
+
+
+def test_rematch_free_pairing_finds_a_pairing_when_there_is_one():
+    randomizer = random.Random(1)
+
+    def exists(players):
+        return not players or any(exists([player for player in players[1:] if player is not other])
+                                  for other in players[1:] if not players[0].has_played_against(other))
+
+    for _ in range(500):
+        players = [Opponent(str(number)) for number in range(randomizer.choice([2, 4, 6, 8]))]
+        density = randomizer.random()
+        for player_one, player_two in itertools.combinations(players, 2):
+            if randomizer.random() < density:
+                player_one.people_played_against[player_two.name] = 1
+                player_two.people_played_against[player_one.name] = 1
+        pairs = pairing.rematch_free_pairing(players, pairing.first_pairing(players))
+        assert (pairs is not None) == exists(players)
+        if pairs is not None:
+            assert all(pairs[pairs[player]] is player and not player.has_played_against(pairs[player])
+                       for player in players)
+
+
+def test_a_group_that_cant_be_paired_in_time_leaves_time_to_the_others():
+    # Two odd groups of players who all met each other: the search can't prove that one rematch is the best.
+    top = [Opponent(f"top{number}", 5) for number in range(60)]
+    for clique in (top[:31], top[31:]):
+        for player_one, player_two in itertools.permutations(clique, 2):
+            player_one.people_played_against[player_two.name] = 1
+    bottom = [Opponent(f"bottom{number}", 1) for number in range(6)]
+    trace = []
+    pairing.score_group_pairing(top + bottom, time_budget=0.5, trace=trace)
+    searches = [entry for entry in trace if entry["phase"] == "anytime_pairing"]
+    assert not searches[0]["optimal"]
+    assert searches[1]["group"] == 1 and searches[1]["optimal"]
+
+
+def test_anytime_search_of_a_large_field_doesnt_recurse():
+    players = [Opponent(str(number), number * 7919 % 1013 / 2) for number in range(1000)]
+    for player_one, player_two in zip(players[::2], players[1::2]):
+        player_one.people_played_against[player_two.name] = 1
+        player_two.people_played_against[player_one.name] = 1
+    players.sort(key=lambda player: -player.points)
+    # The search goes 500 games deep, which a recursion couldn't do.
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(300)
+    try:
+        pairs, optimal, nodes = pairing.anytime_search(players, time.time() + 1)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    assert len(pairs) == len(players) and nodes > len(players) // 2
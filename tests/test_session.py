@@ -0,0 +1,33 @@
+import builtins
+import json
+import os
+import runpy
+
+import session
+from models import snapshot
+
+from conftest import make_tournament
+
+
+def test_a_recorded_session_replays_with_the_same_output(database, tmp_path, monkeypatch):
+    make_tournament(player_amount=8, max_round=4)
+    answers = ["charger_tournoi --nom_du_tournoi Open"]
+    for _ in range(4):
+        answers += ["tour_suivant", "afficher_tour_actuel", "résultats --résultats 1 1-0, 2 0-1, 3 1/2-1/2, 4 1-0",
+                    "o", "finir_tour"]
+    answers += ["afficher_joueurs", "exit", "fermer"]
+    typed = iter(answers)
+    monkeypatch.setattr(builtins, "input", lambda text: next(typed))
+    # The replay publishes its snapshots in its own folder.
+    monkeypatch.setattr(snapshot, "DIRECTORY", snapshot.DIRECTORY)
+    program = runpy.run_path(os.path.join(os.path.dirname(session.__file__), "__main__.py"), run_name="program")
+    recording_view = session.RecordingView(str(tmp_path / "session.json"), page=False)
+    program["main"](view=recording_view)
+    recording_view.save()
+    with open(tmp_path / "session.json", encoding="utf-8") as session_file:
+        recorded = json.load(session_file)
+    replay_directory = tmp_path / "replay"
+    replay_directory.mkdir()
+    view, _ = session.replay(recorded, str(replay_directory))
+    assert session.differences(recorded, view) == []
+    assert len(view.outputs) == len(answers) + 1
@@ -0,0 +1,25 @@
+from models import core, db, writer
+
+from conftest import make_tournament
+
+
+def test_saves_in_a_burst_are_written_once(database, monkeypatch):
+    tournament = make_tournament(rounds_played=1)
+    written = []
+    original_write = core.TournamentSave.write
+    monkeypatch.setattr(core.TournamentSave, "write", lambda save: (written.append(save), original_write(save))[1])
+    background_writer = writer.start(delay=60)
+    for _ in range(2):
+        tournament.create_round()
+        for game in tournament.rounds[-1].games:
+            game.set_score("1-0")
+        tournament.rounds[-1].finish()
+        tournament.save()
+    assert background_writer.pending == 1
+    writer.stop()
+    assert not background_writer.take_errors()
+    assert len(written) == 1
+    stored = db.TOURNAMENT_TABLES.get(tournament.db_query)
+    assert len(stored["rounds"]) == 3
+    assert stored["version"] == tournament.version
+    assert len(core.Tournament.get_tournament(tournament.name)[0].rounds) == 3